@@ -0,0 +1,158 @@
+"""
+End to end benchmark of the alert path: polls a local OREF replay server through the real
+check_and_publish_alerts, and delivers to a fake Telegram Bot API, with N synthetic subscribers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from fake_telegram_server import FakeTelegramServer
+from oref_replay_server import EXAMPLES_FOLDER, OrefReplayServer, load_alerts
+
+OREF_PORT = 18080
+TELEGRAM_PORT = 18081
+FAKE_TOKEN = "123456:fake"
+
+
+def configure_environment(args: argparse.Namespace, folder: str) -> None:
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": FAKE_TOKEN,
+            "SUPERUSER_ID": "1",
+            "ALERT_CHECK_INTERVAL": "1",
+            "SQLITE_DB_PATH": os.path.join(folder, "benchmark.db"),
+            "DEBUG_FOLDER": os.path.join(folder, "debug"),
+            "OREF_BASE_URL": f"http://127.0.0.1:{OREF_PORT}",
+            "DISPATCH_GLOBAL_RATE": str(args.global_rate),
+        }
+    )
+    sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+def seed_subscribers(count: int, locations_per_user: int, all_ratio: float) -> None:
+    from database import add_subscriptions
+    from gazetteer import gazetteer
+
+    with open(EXAMPLES_FOLDER / "alert_history_example.json", encoding="utf-8") as f:
+        known_locations = sorted({row["data"] for row in json.load(f)})
+    rows = []
+    for user_id in range(1, count + 1):
+        if random.random() < all_ratio:
+            rows.append((user_id, "all"))
+            continue
+        rows.extend(
+            (user_id, location)
+            for location in random.sample(known_locations, locations_per_user)
+        )
+    add_subscriptions(rows)
+    gazetteer.load()
+
+
+def reset_alert_state() -> None:
+    """Forget handled alerts, so replaying the same alert is delivered again"""
+    import alert_monitor
+
+    alert_monitor.alerts_handled.clear()
+    alert_monitor.alert_dedup.clear()
+
+
+async def run(args: argparse.Namespace) -> None:
+    from telegram import Bot
+
+    from alert_monitor import check_and_publish_alerts
+    from dispatcher import dispatcher
+    from fetch_from_oref import close_session, fetch_stats, start_session
+
+    oref = OrefReplayServer(load_alerts(args.debug_folder), args.malformed)
+    telegram = FakeTelegramServer(latency=args.telegram_latency / 1000)
+    await oref.start(port=OREF_PORT)
+    await telegram.start(port=TELEGRAM_PORT)
+    bot = Bot(FAKE_TOKEN, base_url=f"http://127.0.0.1:{TELEGRAM_PORT}/bot")
+    await bot.initialize()
+    await start_session()
+    context = SimpleNamespace(bot=bot)
+
+    latencies = []
+    rates = []
+    try:
+        for index in range(args.alerts):
+            reset_alert_state()
+            oref.serve_alert(index)
+            telegram.sent.clear()
+            started = time.perf_counter()
+            await check_and_publish_alerts(context)
+            polled = time.perf_counter()
+            await dispatcher.drain()
+            if not telegram.sent:
+                print(f"alert {index}: no messages delivered")
+                continue
+            first = telegram.sent[0][0]
+            last = telegram.sent[-1][0]
+            latencies.append(last - started)
+            rates.append(len(telegram.sent) / max(last - first, 1e-9))
+            print(
+                f"alert {index}: {len(telegram.sent)} messages, "
+                f"poll done after {(polled - started) * 1000:.1f}ms, "
+                f"poll to last delivery {(last - started) * 1000:.1f}ms, "
+                f"{rates[-1]:.0f} messages/s"
+            )
+            oref.serve_alert(None)
+    finally:
+        await close_session()
+        await bot.shutdown()
+        await telegram.stop()
+        await oref.stop()
+
+    if latencies:
+        latencies.sort()
+        print(
+            f"\n{args.subscribers} subscribers, {len(latencies)} alerts: "
+            f"poll to last delivery p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+            f"max={latencies[-1] * 1000:.1f}ms, "
+            f"mean throughput {sum(rates) / len(rates):.0f} messages/s"
+        )
+    print(f"OREF fetches: {fetch_stats}")
+    if telegram.too_long:
+        print(f"Messages refused for being too long: {telegram.too_long}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--locations-per-user", type=int, default=3)
+    parser.add_argument(
+        "--all-ratio", type=float, default=0.05, help="Share of users subscribed to all"
+    )
+    parser.add_argument("--alerts", type=int, default=5)
+    parser.add_argument(
+        "--global-rate",
+        type=float,
+        default=30,
+        help="Dispatcher messages/s, raise it to measure the bot rather than the rate limit",
+    )
+    parser.add_argument(
+        "--telegram-latency", type=float, default=0, help="Fake API latency in ms"
+    )
+    parser.add_argument("--malformed", action="store_true")
+    parser.add_argument("--debug-folder", help="Also replay recorded debug alerts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        configure_environment(args, folder)
+        os.makedirs(os.environ["DEBUG_FOLDER"])
+        seed_subscribers(args.subscribers, args.locations_per_user, args.all_ratio)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
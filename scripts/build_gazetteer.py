@@ -0,0 +1,26 @@
+import json
+
+with open(
+    "../example_responses/alert_history_example.json",
+    "r",
+    encoding="utf-8",
+) as f:
+    history = json.load(f)
+
+with open(
+    "../example_responses/alert_response_example.json",
+    "r",
+    encoding="utf-8",
+) as f:
+    alert = json.load(f)
+
+locations = sorted({row["data"] for row in history} | set(alert["data"]))
+
+print(f"{len(locations)} locations")
+
+with open(
+    "../src/data/locations.json",
+    "w",
+    encoding="utf-8",
+) as f:
+    json.dump(locations, f, ensure_ascii=False, indent=0)
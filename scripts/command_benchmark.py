@@ -0,0 +1,165 @@
+"""
+Benchmark of bot command latency, from an update reaching the bot to its reply reaching a fake Telegram Bot API,
+with updates either long polled through getUpdates or pushed to the webhook server.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+from fake_telegram_server import FakeTelegramServer
+
+TELEGRAM_PORT = 18081
+WEBHOOK_PORT = 18443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = "benchmark"
+FAKE_TOKEN = "123456:fake"
+
+
+def configure_environment(folder: str) -> None:
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": FAKE_TOKEN,
+            "TELEGRAM_BASE_URL": f"http://127.0.0.1:{TELEGRAM_PORT}/bot",
+            "SUPERUSER_ID": "1",
+            "ALERT_CHECK_INTERVAL": "1",
+            "SQLITE_DB_PATH": os.path.join(folder, "benchmark.db"),
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(WEBHOOK_PORT),
+            "WEBHOOK_PATH": WEBHOOK_PATH,
+            "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        }
+    )
+    sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+async def wait_for_replies(
+    telegram: FakeTelegramServer, chat_ids: set[int], timeout: float
+) -> dict[int, float]:
+    """Wait for a reply to every chat, returning the time each one was sent at."""
+    replies: dict[int, float] = {}
+    deadline = time.perf_counter() + timeout
+    while len(replies) < len(chat_ids) and time.perf_counter() < deadline:
+        for sent_at, chat_id, _ in telegram.sent:
+            if chat_id in chat_ids:
+                replies.setdefault(chat_id, sent_at)
+        await asyncio.sleep(0.001)
+    return replies
+
+
+async def post_update(session: aiohttp.ClientSession, update: dict) -> int:
+    """Push an update to the webhook server, as Telegram would."""
+    from webhook import SECRET_HEADER
+
+    async with session.post(
+        f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}",
+        json=update,
+        headers={SECRET_HEADER: WEBHOOK_SECRET},
+    ) as response:
+        return response.status
+
+
+async def run(args: argparse.Namespace) -> None:
+    from bot import build_application
+    from database import load_snapshot
+    from gazetteer import gazetteer
+    from regions import regions
+    from webhook import WebhookServer
+
+    load_snapshot()
+    gazetteer.load()
+    regions.load()
+    telegram = FakeTelegramServer(latency=args.telegram_latency / 1000)
+    await telegram.start(port=TELEGRAM_PORT)
+    application = build_application()
+    await application.initialize()
+    await application.start()
+
+    server = None
+    session = aiohttp.ClientSession()
+    if args.mode == "webhook":
+        server = WebhookServer(application)
+        await server.start()
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    latencies = []
+    rejected = 0
+    try:
+        for burst in range(args.bursts):
+            chat_ids = set(
+                range(burst * args.burst_size + 2, (burst + 1) * args.burst_size + 2)
+            )
+            telegram.sent.clear()
+            started = time.perf_counter()
+            updates = [
+                telegram.push_command(chat_id, args.command) for chat_id in chat_ids
+            ]
+            if server is not None:
+                statuses = await asyncio.gather(
+                    *(post_update(session, update) for update in updates)
+                )
+                rejected += sum(status != 200 for status in statuses)
+                # Telegram would retry the refused ones later
+                chat_ids = {
+                    update["message"]["chat"]["id"]
+                    for update, status in zip(updates, statuses)
+                    if status == 200
+                }
+            replies = await wait_for_replies(telegram, chat_ids, args.timeout)
+            burst_latencies = sorted(sent_at - started for sent_at in replies.values())
+            latencies.extend(burst_latencies)
+            if burst_latencies:
+                print(
+                    f"burst {burst}: {len(replies)}/{len(chat_ids)} replies, "
+                    f"last after {burst_latencies[-1] * 1000:.1f}ms"
+                )
+    finally:
+        if server is not None:
+            await server.close()
+        else:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await session.close()
+        await telegram.stop()
+
+    if latencies:
+        latencies.sort()
+        print(
+            f"\n{args.mode}: {len(latencies)} replies to {args.command}, "
+            f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+            f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}ms "
+            f"max={latencies[-1] * 1000:.1f}ms"
+        )
+    if server is not None:
+        print(f"Webhook: {server}, rejected by the benchmark's count: {rejected}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="webhook")
+    parser.add_argument("--command", default="/help")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument(
+        "--telegram-latency", type=float, default=0, help="Fake API latency in ms"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Seconds to wait for the replies"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        configure_environment(folder)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 from collections import defaultdict
@@ -5,25 +6,43 @@ from collections import defaultdict
 data = defaultdict(int)
 counter = 0
 interesting_files = []
-for file in os.listdir("../debug_data"):
-    interesting = True
+
+
+def read_errors(file: str) -> list[list[str]]:
+    """Read the lines of every error in either a legacy error log or a JSONL segment"""
+    path = f"../debug_data/{file}"
     if "error_log" in file:
-        with open(f"../debug_data/{file}", "r", encoding="utf-8") as f:
-            counter += 1
-            lines = f.readlines()
-            if len(lines) == 0:
+        with open(path, "r", encoding="utf-8") as f:
+            return [f.readlines()]
+    opener = gzip.open if file.endswith(".gz") else open
+    errors = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["kind"] == "error":
+                errors.append([record["error"], *record["content"].splitlines()])
+    return errors
+
+
+for file in os.listdir("../debug_data"):
+    if "error_log" not in file and ".jsonl" not in file:
+        continue
+    for lines in read_errors(file):
+        interesting = True
+        counter += 1
+        if len(lines) == 0:
+            interesting = False
+        for line in lines:
+            if line.strip() == "":
+                continue
+            if "traceback object" in line:
+                data["traceback"] += 1
+            else:
+                data[line] += 1
+            if "JSONDecodeError: Expecting value: line 1 column 1" in line:
                 interesting = False
-            for line in lines:
-                if line.strip() == "":
-                    continue
-                if "traceback object" in line:
-                    data["traceback"] += 1
-                else:
-                    data[line] += 1
-                if "JSONDecodeError: Expecting value: line 1 column 1" in line:
-                    interesting = False
-            if interesting:
-                interesting_files.append(file)
-print(f"total files: {counter}")
+        if interesting and file not in interesting_files:
+            interesting_files.append(file)
+print(f"total errors: {counter}")
 print(json.dumps(data, indent=4))
 print("\n".join(interesting_files))
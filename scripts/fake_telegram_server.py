@@ -0,0 +1,129 @@
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+MESSAGE_LIMIT = 4096  # UTF-16 code units
+
+FAKE_BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Fake Red Alert",
+    "username": "fake_red_alert_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True,
+}
+
+
+class FakeTelegramServer:
+    """
+    A local stand-in for the Telegram Bot API, recording every message sent to it.
+    Like Telegram, it refuses messages longer than MESSAGE_LIMIT.
+    Point the bot at it with base_url=f"http://{host}:{port}/bot".
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.sent: list[tuple[float, int, str]] = []
+        self.too_long = 0
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.webhook_url = ""
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_command(self, chat_id: int, text: str) -> dict:
+        """Queue an incoming command message, as getUpdates or a webhook would deliver it."""
+        update = {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+                "text": text,
+                "entities": [
+                    {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+                ],
+            },
+        }
+        self.updates.put_nowait(update)
+        return update
+
+    async def _read_parameters(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        parameters = {}
+        for key, value in (await request.post()).items():
+            try:
+                parameters[key] = json.loads(value)
+            except (TypeError, json.JSONDecodeError):
+                parameters[key] = value
+        return parameters
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        parameters = await self._read_parameters(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if (
+            method == "sendMessage"
+            and len(parameters["text"].encode("utf-16-le")) // 2 > MESSAGE_LIMIT
+        ):
+            self.too_long += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 400,
+                    "description": "Bad Request: message is too long",
+                },
+                status=400,
+            )
+        result = await self._call(method, parameters)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _call(self, method: str, parameters: dict):
+        match method:
+            case "getMe":
+                return FAKE_BOT_USER
+            case "sendMessage":
+                chat_id = int(parameters["chat_id"])
+                self.sent.append((time.perf_counter(), chat_id, parameters["text"]))
+                return {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": parameters["text"],
+                }
+            case "getUpdates":
+                try:
+                    update = await asyncio.wait_for(
+                        self.updates.get(), float(parameters.get("timeout", 0)) or 0.1
+                    )
+                except TimeoutError:
+                    return []
+                updates = [update]
+                while not self.updates.empty():
+                    updates.append(self.updates.get_nowait())
+                return updates
+            case "setWebhook":
+                self.webhook_url = parameters.get("url", "")
+                return True
+            case "deleteWebhook" | "setMyCommands" | "answerInlineQuery":
+                return True
+            case _:
+                return True
@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+
+EXAMPLES_FOLDER = Path(__file__).parent.parent / "example_responses"
+EMPTY_RESPONSE_BODY = "﻿\r\n".encode("utf-8")
+FILETIME_UNIX_EPOCH = 116444736000000000
+MALFORMATIONS = ["bom", "nul", "garbage"]
+
+
+def load_recorded_alerts(folder: str) -> list[dict]:
+    """Load alerts recorded to the debug folder, both legacy alert logs and JSONL segments"""
+    alerts = []
+    for file in sorted(os.listdir(folder)):
+        path = os.path.join(folder, file)
+        if file.startswith("alert_log_") and file.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                alerts.append(json.load(f))
+        elif ".jsonl" in file:
+            opener = gzip.open if file.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                alerts.extend(
+                    record["data"]
+                    for record in map(json.loads, f)
+                    if record["kind"] == "alert"
+                )
+    return alerts
+
+
+def malform(body: bytes, malformation: str | None) -> bytes:
+    """Wrap a body the ways OREF was seen breaking it"""
+    match malformation:
+        case "bom":
+            return b"\xef\xbb\xbf" + body + b"\r\n"
+        case "nul":
+            return b"\x00\x00" + body + b"\x00" * 16
+        case "garbage":
+            return "﻿\r\n \x00".encode("utf-8") + body
+        case _:
+            return body
+
+
+class OrefReplayServer:
+    """
+    A local stand-in for the OREF alert feed, replaying recorded alerts.
+    Every served alert gets a fresh ID, so it looks like a new alert raised when it started being served.
+    """
+
+    def __init__(self, alerts: list[dict], malformed: bool = False) -> None:
+        self.alerts = alerts
+        self.malformed = malformed
+        self.requests = 0
+        self._current: bytes = EMPTY_RESPONSE_BODY
+        self._served = 0
+        self._history = (EXAMPLES_FOLDER / "alert_history_example.json").read_bytes()
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        app = web.Application()
+        app.router.add_get("/", self._handle_home)
+        app.router.add_get("/WarningMessages/alert/alerts.json", self._handle_alerts)
+        app.router.add_get(
+            "/WarningMessages/alert/History/AlertsHistory.json", self._handle_history
+        )
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def serve_alert(self, index: int | None) -> None:
+        """Start serving the alert at the given index, or an empty feed if None."""
+        if index is None:
+            self._current = malform(EMPTY_RESPONSE_BODY, None)
+            return
+        alert = dict(self.alerts[index % len(self.alerts)])
+        alert["id"] = str(int(time.time() * 10_000_000) + FILETIME_UNIX_EPOCH)
+        malformation = (
+            MALFORMATIONS[self._served % len(MALFORMATIONS)] if self.malformed else None
+        )
+        self._served += 1
+        self._current = malform(
+            json.dumps(alert, ensure_ascii=False).encode("utf-8"), malformation
+        )
+
+    async def run_timeline(self, alert_seconds: float, gap_seconds: float) -> None:
+        """Serve every alert for alert_seconds, with gap_seconds of empty feed between them."""
+        for index in range(len(self.alerts)):
+            self.serve_alert(index)
+            logger.info(f"Serving alert {index + 1}/{len(self.alerts)}")
+            await asyncio.sleep(alert_seconds)
+            self.serve_alert(None)
+            await asyncio.sleep(gap_seconds)
+
+    async def _handle_home(self, request: web.Request) -> web.Response:
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    async def _handle_alerts(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.Response(body=self._current, content_type="application/json")
+
+    async def _handle_history(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._history, content_type="application/json")
+
+
+def load_alerts(debug_folder: str | None) -> list[dict]:
+    with open(EXAMPLES_FOLDER / "alert_response_example.json", encoding="utf-8") as f:
+        alerts = [json.load(f)]
+    if debug_folder:
+        alerts.extend(load_recorded_alerts(debug_folder))
+    return alerts
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = OrefReplayServer(load_alerts(args.debug_folder), args.malformed)
+    await server.start(args.host, args.port)
+    logger.info(
+        f"Replaying {len(server.alerts)} alerts on http://{args.host}:{args.port}, "
+        f"set OREF_BASE_URL to point the bot at it"
+    )
+    try:
+        while True:
+            await server.run_timeline(args.alert_seconds, args.gap_seconds)
+            if not args.loop:
+                break
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay OREF alerts locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--debug-folder", help="Also replay alerts recorded to this debug folder"
+    )
+    parser.add_argument("--alert-seconds", type=float, default=10)
+    parser.add_argument("--gap-seconds", type=float, default=20)
+    parser.add_argument(
+        "--malformed", action="store_true", help="Wrap bodies in BOM/NUL garbage"
+    )
+    parser.add_argument("--loop", action="store_true")
+    asyncio.run(main(parser.parse_args()))
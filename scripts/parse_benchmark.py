@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of parsing OREF bodies, comparing the previous text based parser with the
+bytes fast path and the body hash check which skips parsing an unchanged body.
+"""
+
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+os.environ.setdefault("SUPERUSER_ID", "1")
+os.environ.setdefault("ALERT_CHECK_INTERVAL", "1")
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from fetch_from_oref import _body_hash, _loads, _parse_body  # noqa: E402
+from oref_replay_server import (  # noqa: E402
+    EMPTY_RESPONSE_BODY,
+    EXAMPLES_FOLDER,
+    MALFORMATIONS,
+    malform,
+)
+
+EMPTY_RESPONSE_TEXT = "﻿\r\n"
+REPEATS = 20
+
+
+def legacy_parse_text(text: str):
+    text = text.strip().replace("\0", "")
+    if text == EMPTY_RESPONSE_TEXT or len(text) == 0:
+        return None
+    if "{" not in text and "[" not in text:
+        return None
+    if text[0] != "{" or text[0] != "[":
+        object_start = float("inf")
+        list_start = float("inf")
+        if "{" in text:
+            object_start = text.index("{")
+        if "[" in text:
+            list_start = text.index("[")
+        if list_start < object_start:
+            text = text[list_start:].encode("utf-8").decode("utf-8-sig")
+        else:
+            text = text[object_start:].encode("utf-8").decode("utf-8-sig")
+
+    return json.loads(text)
+
+
+def bench(name: str, statement, number: int) -> None:
+    times = timeit.repeat(statement, number=number, repeat=REPEATS)
+    print(f"{name:<45} {min(times) / number * 1e6:10.1f}us")
+
+
+def main() -> None:
+    print(f"JSON decoder: {_loads.__module__}.{_loads.__name__}\n")
+    bodies = {"empty": EMPTY_RESPONSE_BODY}
+    for example in ("alert_response_example.json", "alert_history_example.json"):
+        body = (EXAMPLES_FOLDER / example).read_bytes()
+        for malformation in [None, *MALFORMATIONS]:
+            bodies[f"{example.split('_')[1]} {malformation or 'clean'}"] = malform(
+                body, malformation
+            )
+
+    for name, body in bodies.items():
+        assert legacy_parse_text(body.decode("utf-8")) == _parse_body(body), name
+        number = 10 if len(body) > 100_000 else 1000
+        print(f"{name} ({len(body)} bytes)")
+        # The legacy parser got the body already decoded to text
+        bench(
+            "  legacy decode + parse",
+            lambda: legacy_parse_text(body.decode("utf-8")),
+            number,
+        )
+        bench("  bytes fast path", lambda: _parse_body(body), number)
+        previous = _body_hash(body)
+        bench(
+            "  unchanged body hash check", lambda: _body_hash(body) == previous, number
+        )
+        print()
+
+
+if __name__ == "__main__":
+    main()
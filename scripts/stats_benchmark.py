@@ -0,0 +1,115 @@
+"""
+Benchmark of the alert statistics, loading the example alert history repeated over many days into a temporary
+alert store, then timing the first load, an incremental refresh and answering for every location.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+EXAMPLE_HISTORY = (
+    Path(__file__).parent.parent / "example_responses" / "alert_history_example.json"
+)
+SECONDS_PER_DAY = 86_400
+
+
+def configure_environment(folder: str) -> None:
+    os.environ.update(
+        {
+            "SUPERUSER_ID": "1",
+            "ALERT_CHECK_INTERVAL": "1",
+            "SQLITE_DB_PATH": os.path.join(folder, "benchmark.db"),
+        }
+    )
+    sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+
+def history_events(days: int) -> list[tuple[str, int, str, str, float]]:
+    """The example history rows as alert events, repeated once for each of the last given days."""
+    with open(EXAMPLE_HISTORY, "r", encoding="utf-8-sig") as f:
+        rows = json.load(f)
+    newest = max(
+        datetime.strptime(row["alertDate"], "%Y-%m-%d %H:%M:%S").timestamp()
+        for row in rows
+    )
+    shift = time.time() - newest
+    events = []
+    for day in range(days):
+        for index, row in enumerate(rows):
+            raised_at = (
+                datetime.strptime(row["alertDate"], "%Y-%m-%d %H:%M:%S").timestamp()
+                + shift
+                - day * SECONDS_PER_DAY
+            )
+            events.append(
+                (
+                    f"benchmark:{day}:{index}",
+                    row["category"],
+                    row["title"],
+                    row["data"],
+                    raised_at,
+                )
+            )
+    return events
+
+
+async def run(args: argparse.Namespace) -> None:
+    from alert_stats import alert_stats
+    from database import add_alert_events, close_db
+    from gazetteer import gazetteer
+
+    gazetteer.load()
+    alert_stats.load()
+    events = history_events(args.days)
+    await add_alert_events(events[: -args.increment])
+
+    started = time.perf_counter()
+    await alert_stats.refresh()
+    print(
+        f"Loaded {len(events) - args.increment} events in {(time.perf_counter() - started) * 1000:.1f}ms: {alert_stats}"
+    )
+
+    await add_alert_events(events[-args.increment :])
+    started = time.perf_counter()
+    await alert_stats.refresh()
+    print(
+        f"Refreshed {args.increment} new events in {(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+
+    location_ids = [location_id for location_id, _ in gazetteer.items()]
+    now = time.time()
+    started = time.perf_counter()
+    answered = sum(
+        alert_stats.get(location_id, now) is not None for location_id in location_ids
+    )
+    elapsed = time.perf_counter() - started
+    print(
+        f"Answered for {len(location_ids)} locations ({answered} with alerts) "
+        f"in {elapsed * 1000:.1f}ms, {elapsed / len(location_ids) * 1e6:.1f}us each"
+    )
+    close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--days", type=int, default=50, help="Copies of the example history"
+    )
+    parser.add_argument(
+        "--increment", type=int, default=100, help="Events added after the first load"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        configure_environment(folder)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
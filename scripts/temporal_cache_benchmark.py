@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of TemporalCache against the previous dict based implementation,
+which only evicted lazily in __contains__ or by scanning every entry in get_all.
+"""
+
+import os
+import sys
+import time
+import timeit
+from pathlib import Path
+
+os.environ.setdefault("SUPERUSER_ID", "1")
+os.environ.setdefault("ALERT_CHECK_INTERVAL", "1")
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from temporal_cache import TemporalCache  # noqa: E402
+
+ENTRIES = 2000
+REPEATS = 20
+
+
+class LegacyTemporalCache[T]:
+    def __init__(self, timeout: float = 180) -> None:
+        self._timeout = timeout
+        self._cache = dict[T, float]()
+
+    def _get_timeout(self) -> float:
+        return time.time() + self._timeout
+
+    def add(self, value: T) -> None:
+        self._cache[value] = self._get_timeout()
+
+    def __contains__(self, key: T) -> bool:
+        expiry_time = self._cache.get(key, None)
+        if expiry_time is None:
+            return False
+        if time.time() >= expiry_time:
+            self._cache.pop(key, None)
+            return False
+        return True
+
+    def get_all(self) -> list[T]:
+        now = time.time()
+        timed_out_values = [
+            value for value, expiry_time in self._cache.items() if now >= expiry_time
+        ]
+        for value in timed_out_values:
+            self._cache.pop(value)
+        return list(self._cache.keys())
+
+    def add_all(self, data: list[T]) -> None:
+        for entry in data:
+            self.add(entry)
+
+
+def bench(name: str, statement, setup=lambda: None) -> None:
+    times = timeit.repeat(statement, setup=setup, number=1, repeat=REPEATS)
+    print(f"{name:<50} {min(times) * 1e6:10.1f}us")
+
+
+def main() -> None:
+    locations = [f"location {i}" for i in range(ENTRIES)]
+    lookups = locations[::2] + [f"missing {i}" for i in range(ENTRIES // 2)]
+    for cache_class in (LegacyTemporalCache, TemporalCache):
+        name = cache_class.__name__
+        cache = cache_class()
+        bench(f"{name}.add_all({ENTRIES})", lambda: cache.add_all(locations))
+        bench(
+            f"{name} {len(lookups)} lookups",
+            lambda: [location in cache for location in lookups],
+        )
+        bench(f"{name}.get_all()", cache.get_all)
+        # Clearing out expired entries when there are none, the legacy cache can only do it by scanning
+        tick = cache.expire if hasattr(cache, "expire") else cache.get_all
+        bench(f"{name} expiry tick, nothing expired", tick)
+
+        expiring = cache_class(timeout=0)
+        bench(
+            f"{name} expire {ENTRIES} entries",
+            lambda: expiring.get_all(),
+            lambda: expiring.add_all(locations),
+        )
+        print()
+
+
+if __name__ == "__main__":
+    main()
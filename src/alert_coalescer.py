@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from functools import lru_cache
+
+from telegram import Bot
+
+from alert_data import AlertData
+from config import COALESCE_BYPASS_CATEGORIES, COALESCE_WINDOW, RENDER_CACHE_SIZE
+from dispatcher import dispatcher
+from message_packer import PackedSection, pack_sections
+from metrics import coalesced_sends_saved, render_seconds
+
+logger = logging.getLogger(__name__)
+
+
+# A (title, description, locations) part of a message
+Section = tuple[str, str, tuple[str, ...]]
+
+
+def alert_section(
+    title: str, description: str, locations: tuple[str, ...]
+) -> PackedSection:
+    return f"🚨 {title} 🚨\n{description}\n\nמיקומים:", locations
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_pages(sections: tuple[Section, ...]) -> tuple[str, ...]:
+    """Render sections into as few messages as they fit in, with the locations split between them by line."""
+    return tuple(pack_sections(alert_section(*section) for section in sections))
+
+
+def render_payloads(
+    user_sections: dict[int, tuple[Section, ...]],
+) -> list[tuple[tuple[str, ...], list[int]]]:
+    """Group users getting identical sections, rendering and packing each distinct message once."""
+    groups: dict[tuple[Section, ...], list[int]] = {}
+    for user_id, sections in user_sections.items():
+        groups.setdefault(sections, []).append(user_id)
+    return [(render_pages(sections), user_ids) for sections, user_ids in groups.items()]
+
+
+class AlertCoalescer:
+    """
+    Holds alert deltas for a short window and merges them into a single message per user,
+    so a barrage of alert IDs and titles costs one send per user instead of one per alert.
+    Alerts of a bypass category are sent right away, taking along anything pending for the same users.
+    """
+
+    def __init__(
+        self,
+        window: float = COALESCE_WINDOW,
+        bypass_categories: frozenset[int] = COALESCE_BYPASS_CATEGORIES,
+    ) -> None:
+        self._window = window
+        self._bypass_categories = bypass_categories
+        # User ID to the pending locations of each title, with the title's description
+        self._pending: dict[int, dict[str, tuple[str, list[str]]]] = {}
+        self._pending_deltas: dict[int, int] = {}
+        self._flush_task: asyncio.Task | None = None
+        self.deltas = 0
+        self.sends = 0
+
+    @property
+    def saved(self) -> int:
+        return self.deltas - self.sends
+
+    def _bypasses(self, alert: AlertData) -> bool:
+        if self._window <= 0:
+            return True
+        try:
+            return int(alert.category) in self._bypass_categories
+        except (TypeError, ValueError):
+            return False
+
+    def _add(self, user_id: int, alert: AlertData, locations: list[str]) -> None:
+        titles = self._pending.setdefault(user_id, {})
+        if alert.title in titles:
+            pending_locations = titles[alert.title][1]
+            pending_locations.extend(
+                location for location in locations if location not in pending_locations
+            )
+        else:
+            titles[alert.title] = (alert.description, list(locations))
+        self._pending_deltas[user_id] = self._pending_deltas.get(user_id, 0) + 1
+
+    def _pop_sections(self, user_id: int) -> tuple[Section, ...]:
+        return tuple(
+            (title, description, tuple(locations))
+            for title, (description, locations) in self._pending.pop(user_id).items()
+        )
+
+    def _send(
+        self, bot: Bot, payloads: list[tuple[tuple[str, ...], list[int]]], deltas: int
+    ) -> None:
+        """Hand the payloads to the dispatcher to send in the background, so polling isn't held up by the fan-out."""
+        messages = sum(len(user_ids) for _, user_ids in payloads)
+        self.deltas += deltas
+        self.sends += messages
+        if deltas > messages:
+            coalesced_sends_saved.inc(deltas - messages)
+        dispatcher.submit_batch(bot, payloads)
+
+    async def submit(
+        self, bot: Bot, alert: AlertData, matches: dict[int, list[str]]
+    ) -> None:
+        """Send the matched locations of an alert to every user, now or once the window closes."""
+        if not matches:
+            return
+        if self._bypasses(alert):
+            with render_seconds.time():
+                user_sections: dict[int, tuple[Section, ...]] = {}
+                deltas = len(matches)
+                for user_id, user_locs in matches.items():
+                    sections = ((alert.title, alert.description, tuple(user_locs)),)
+                    if user_id in self._pending:
+                        sections += self._pop_sections(user_id)
+                        deltas += self._pending_deltas.pop(user_id)
+                    user_sections[user_id] = sections
+                payloads = render_payloads(user_sections)
+            self._send(bot, payloads, deltas)
+            return
+
+        for user_id, user_locs in matches.items():
+            self._add(user_id, alert, user_locs)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(bot))
+
+    async def _flush_later(self, bot: Bot) -> None:
+        await asyncio.sleep(self._window)
+        self._flush_task = None
+        await self.flush(bot)
+
+    async def flush(self, bot: Bot) -> None:
+        """Send everything pending right away."""
+        with render_seconds.time():
+            payloads = render_payloads(
+                {
+                    user_id: self._pop_sections(user_id)
+                    for user_id in list(self._pending)
+                }
+            )
+        deltas = sum(self._pending_deltas.values())
+        self._pending_deltas.clear()
+        if payloads:
+            logger.info(
+                f"Coalesced {deltas} alert deltas into {sum(len(user_ids) for _, user_ids in payloads)} messages"
+            )
+        self._send(bot, payloads, deltas)
+
+    async def close(self, bot: Bot) -> None:
+        """Stop waiting for the window and hand everything still pending to the dispatcher."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush(bot)
+
+    def __str__(self):
+        return (
+            f"AlertCoalescer(window={self._window}s, deltas={self.deltas}, sends={self.sends}, "
+            f"saved={self.saved}, pending_users={len(self._pending)})"
+        )
+
+
+alert_coalescer = AlertCoalescer()
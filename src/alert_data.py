@@ -1,4 +1,9 @@
 EMPTY_RESPONSE_TEXT = "\ufeff\r\n"
+HISTORY_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+FILETIME_UNIX_EPOCH = 116444736000000000
+"""
+Alert IDs seem to be Windows file times, 100ns intervals since 1601, of when the alert was raised.
+"""
 
 
 class AlertData:
@@ -16,6 +21,14 @@ class AlertData:
         self.locations: list[str] = locations
         self.description: str = description
 
+    @property
+    def raised_at(self) -> float | None:
+        """Unix time at which the alert was raised, if it can be told from its ID."""
+        try:
+            return (int(self.id) - FILETIME_UNIX_EPOCH) / 10_000_000
+        except ValueError:
+            return None
+
     def __str__(self, direction=-1):
         return f"AlertResponse(id={self.id}, category={self.category}, title={self.title[::direction]}, data={list(map(lambda x: x[::direction], self.locations))}, desc={self.description[::direction]})"
 
@@ -0,0 +1,78 @@
+import logging
+from collections import OrderedDict
+
+from config import DEDUP_MAX_ALERTS, DEDUP_MAX_LOCATIONS
+from metrics import dedup_evictions
+
+logger = logging.getLogger(__name__)
+
+
+class AlertDeduplicator:
+    """
+    Remembers which locations were already handled for recently seen alert IDs.
+    Kept as a bounded LRU, evicting the least recently seen alert once either the number of alerts
+    or the total number of remembered locations goes over its cap.
+    """
+
+    def __init__(
+        self,
+        max_alerts: int = DEDUP_MAX_ALERTS,
+        max_locations: int = DEDUP_MAX_LOCATIONS,
+    ) -> None:
+        self._max_alerts = max_alerts
+        self._max_locations = max_locations
+        self._handled: OrderedDict[str, set[str]] = OrderedDict()
+        self._location_count = 0
+        self.evictions = 0
+        # Changes whenever locations are marked as handled
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._handled)
+
+    def __contains__(self, alert_id: str) -> bool:
+        return alert_id in self._handled
+
+    def delta(self, alert_id: str, locations: list[str]) -> list[str]:
+        """Returns the locations not yet handled for this alert ID, marking them as handled."""
+        handled = self._handled.get(alert_id)
+        if handled is None:
+            handled = self._handled[alert_id] = set()
+        else:
+            self._handled.move_to_end(alert_id)
+        new_locations = [location for location in locations if location not in handled]
+        handled.update(new_locations)
+        self._location_count += len(new_locations)
+        if new_locations:
+            self.version += 1
+        self._evict(keep=alert_id)
+        return new_locations
+
+    def clear(self) -> None:
+        self._handled.clear()
+        self._location_count = 0
+        self.version += 1
+
+    def dump(self) -> list[tuple[str, list[str]]]:
+        """Get the handled locations of every alert ID, least recently seen first."""
+        return [
+            (alert_id, list(locations)) for alert_id, locations in self._handled.items()
+        ]
+
+    def restore(self, entries: list[tuple[str, list[str]]]) -> None:
+        """Mark dumped locations as handled, keeping their order."""
+        for alert_id, locations in entries:
+            self.delta(alert_id, locations)
+
+    def _evict(self, keep: str) -> None:
+        while len(self._handled) > 1 and (
+            len(self._handled) > self._max_alerts
+            or self._location_count > self._max_locations
+        ):
+            alert_id, locations = next(iter(self._handled.items()))
+            if alert_id == keep:
+                break
+            del self._handled[alert_id]
+            self._location_count -= len(locations)
+            self.evictions += 1
+            dedup_evictions.inc()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from telegram.ext import CallbackContext
+
+from alert_data import HISTORY_DATE_FORMAT, AlertData
+from alert_monitor import get_alert_history
+from alert_store import alert_store
+from config import ACTIVE_ALERTS_WINDOW, HISTORY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class AlertHistoryService:
+    """
+    Shares one fetch of the alert history between all concurrent callers, and caches it for a short TTL
+    together with a time sorted index, so time window queries are a binary search.
+    Only the last `window` of the history is fetched, older alerts are never returned.
+    """
+
+    def __init__(
+        self,
+        ttl: float = HISTORY_CACHE_TTL,
+        window: timedelta = timedelta(minutes=ACTIVE_ALERTS_WINDOW),
+    ) -> None:
+        self._ttl = ttl
+        self._window = window
+        self._fetched_at = float("-inf")
+        self._times: list[datetime] = []
+        self._alerts: list[list[AlertData]] = []
+        self._inflight: asyncio.Task | None = None
+
+    async def _refresh(self) -> None:
+        try:
+            history = await get_alert_history(self._window)
+            index = sorted(
+                (datetime.strptime(date, HISTORY_DATE_FORMAT), alerts)
+                for date, alerts in history.items()
+            )
+            self._times = [date for date, _ in index]
+            self._alerts = [alerts for _, alerts in index]
+            self._fetched_at = time.monotonic()
+            logger.debug(f"Alert history refreshed with {len(index)} timestamps")
+        finally:
+            self._inflight = None
+
+    async def _ensure_fresh(self) -> None:
+        if time.monotonic() - self._fetched_at < self._ttl:
+            return
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._refresh())
+        # Shielded so one caller being cancelled doesn't cancel the fetch for everyone else
+        await asyncio.shield(self._inflight)
+
+    async def get_history_since(
+        self, since: datetime
+    ) -> list[tuple[datetime, list[AlertData]]]:
+        """Get the alerts raised at or after the given time together with their time, oldest first."""
+        await self._ensure_fresh()
+        start = bisect_left(self._times, since)
+        return list(zip(self._times[start:], self._alerts[start:]))
+
+    async def get_alerts_since(self, since: datetime) -> list[AlertData]:
+        """Get all alerts raised at or after the given time."""
+        await self._ensure_fresh()
+        start = bisect_left(self._times, since)
+        return [alert for alerts in self._alerts[start:] for alert in alerts]
+
+    async def get_active_alerts(self, minutes: int) -> list[AlertData]:
+        """Get all alerts raised in the last given minutes."""
+        return await self.get_alerts_since(datetime.now() - timedelta(minutes=minutes))
+
+
+alert_history = AlertHistoryService()
+
+
+async def sync_alert_store(context: CallbackContext) -> None:
+    """Fill in the alert store with the alerts of the recent history the live feed missed."""
+    try:
+        await alert_store.add_history(
+            await alert_history.get_history_since(
+                datetime.now() - timedelta(minutes=ACTIVE_ALERTS_WINDOW)
+            )
+        )
+    except Exception as e:
+        logger.error(f"Error syncing the alert history: {type(e).__name__}: {e}")
+
+
+async def backfill_alert_store(context: CallbackContext) -> None:
+    """Store all of the alert history OREF still serves, for the statistics to start from."""
+    try:
+        history = await get_alert_history()
+        await alert_store.add_history(
+            sorted(
+                (datetime.strptime(date, HISTORY_DATE_FORMAT), alerts)
+                for date, alerts in history.items()
+            )
+        )
+    except Exception as e:
+        logger.error(f"Error backfilling the alert history: {type(e).__name__}: {e}")
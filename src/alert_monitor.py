@@ -1,59 +1,81 @@
-import json
 import logging
+import time
 import traceback
 import uuid
-from collections import defaultdict, namedtuple
-from datetime import datetime
-from itertools import groupby
+from collections import defaultdict
+from datetime import datetime, timedelta
 
+from telegram import Bot
 from telegram.ext import CallbackContext
 
-from alert_data import AlertData
-from config import DEBUG_FOLDER
-from database import get_all_subscriptions
-from fetch_from_oref import fetch_data_from_oref
+from alert_coalescer import alert_coalescer
+from alert_data import HISTORY_DATE_FORMAT, AlertData
+from alert_dedup import AlertDeduplicator
+from alert_store import alert_store
+from cluster import LEADER_ROLE, cluster_leader
+from config import CLUSTER_ROLE
+from fetch_from_oref import (
+    fetch_data_from_oref,
+    is_feed_empty,
+    iter_rows_from_oref,
+)
+from gazetteer import gazetteer
+from log_sink import log_sink
+from metrics import dedup_hits, match_seconds
+from poll_scheduler import AdaptivePollScheduler
+from subscription_matcher import subscription_matcher
 from temporal_cache import TemporalCache
 
 logger = logging.getLogger(__name__)
 
 alerts_handled = defaultdict(lambda: TemporalCache[str]())
-handled_ids = set()
+alert_dedup = AlertDeduplicator()
 """
 Pikud ha'oref suck, so they don't necessarily clear the last alert? This happened once, but now it means this cache can't be temporary...
+The same ID is also re-published with more locations added, so the handled locations are kept per ID.
 """
-DebugData = namedtuple("DebugData", ["file", "data"])
 
 
 def add_alert_to_cache(alert_data: AlertData):
-    handled_ids.add(alert_data.id)
     alerts_handled[alert_data.title].add_all(alert_data.locations)
 
 
+async def expire_alert_caches(context: CallbackContext) -> None:
+    """Expire handled locations, dropping the caches of titles with nothing left in them."""
+    now = time.monotonic()
+    for title in list(alerts_handled):
+        alerts_handled[title].expire(now)
+        if len(alerts_handled[title]) == 0:
+            del alerts_handled[title]
+
+
 async def get_active_alert(save_data=True) -> AlertData | None:
-    debug_data: DebugData | None = None
     try:
-        data = await fetch_data_from_oref(save_data, "alerts.json")
-        if not data or data["id"] in handled_ids:
+        data = await fetch_data_from_oref(save_data, "alerts.json", skip_unchanged=True)
+        if not data:
+            return None
+        new_locations = alert_dedup.delta(data["id"], data["data"])
+        if not new_locations:
+            dedup_hits.inc()
             return None
 
         logger.info(
-            f"Alert '{data['title']}' with ID: {data['id']} in progress, number of locations: {len(data['data'])}"
+            f"Alert '{data['title']}' with ID: {data['id']} in progress, number of locations: {len(data['data'])}, new: {len(new_locations)}"
         )
 
         current_alert_category_location_cache = alerts_handled[data["title"]]
         filtered_locations = [
             location
-            for location in data["data"]
+            for location in new_locations
             if location not in current_alert_category_location_cache
         ]
 
         if len(filtered_locations) == 0:
+            dedup_hits.inc()
             return None
 
-        debug_data = DebugData(
-            f"{DEBUG_FOLDER}/alert_log_{data['id']}.json",
-            json.dumps(data, ensure_ascii=False, indent=4),
-        )
+        if save_data:
+            log_sink.submit("alert", {"id": data["id"], "data": data})
 
         return AlertData(
             data["id"],
@@ -66,80 +88,103 @@ async def get_active_alert(save_data=True) -> AlertData | None:
         logger.exception(
             f"Error checking alerts: {type(e).__name__}: {e}\n{e.__traceback__}"
         )
-        debug_data = DebugData(
-            f"{DEBUG_FOLDER}/error_log_{datetime.now().strftime('%d_%m_%y_%H_%M_%S')}.txt",
-            f"{type(e).__name__}: {e}\n{traceback.format_tb(e.__traceback__)}\n\ncontent: {'\n'.join(
-                e.__notes__)}\n",
-        )
+        if save_data:
+            log_sink.submit(
+                "error",
+                {
+                    "error": f"{type(e).__name__}: {e}",
+                    "traceback": traceback.format_tb(e.__traceback__),
+                    "content": "\n".join(getattr(e, "__notes__", [])),
+                },
+            )
         return None
-    finally:
-        if save_data and debug_data:
-            with open(debug_data.file, "w") as f:
-                f.write(debug_data.data)
 
 
-async def get_alert_history() -> dict[str, list[AlertData]]:
+async def get_alert_history(
+    window: timedelta | None = None,
+) -> dict[str, list[AlertData]]:
     """
-    Fetches alert history data and parses it into AlertData.
+    Fetches alert history data and parses it into AlertData, grouped by alert date.
     The lists will usually be 1 length lists, but I can't ensure that due to the unknown behavior of the API.
+    The feed is newest first, so when a window is given parsing stops at the first row older than it.
     """
-    data: list[dict[str, str]] = await fetch_data_from_oref(
-        False, "History/AlertsHistory.json"
-    )
-    if not data:
-        return {}
-    key_func = lambda x: x["alertDate"]
-    grouped_data = {
-        key: list(group) for key, group in groupby(sorted(data, key=key_func), key_func)
+    cutoff = (datetime.now() - window).strftime(HISTORY_DATE_FORMAT) if window else None
+    grouped_alerts: dict[str, dict[str, AlertData]] = {}
+    async for alert in iter_rows_from_oref("History/AlertsHistory.json"):
+        # The date format sorts lexicographically, so there's no need to parse it
+        if cutoff and alert["alertDate"] < cutoff:
+            break
+        parsed_alerts = grouped_alerts.setdefault(alert["alertDate"], {})
+        if alert["title"] not in parsed_alerts:
+            parsed_alerts[alert["title"]] = AlertData(
+                uuid.uuid4().hex,
+                alert["category"],
+                alert["title"],
+                [alert["data"]],
+                alert["title"],
+            )
+        else:
+            parsed_alerts[alert["title"]].locations.append(alert["data"])
+    return {
+        date: list(parsed_alerts.values())
+        for date, parsed_alerts in grouped_alerts.items()
     }
 
-    all_alerts: dict[str, list[AlertData]] = {}
-    for date, alerts in grouped_data.items():
-        parsed_alerts: dict[str, AlertData] = {}
-        for alert in alerts:
-            if alert["title"] not in parsed_alerts:
-                parsed_alerts[alert["title"]] = AlertData(
-                    uuid.uuid4().hex,
-                    alert["category"],
-                    alert["title"],
-                    [alert["data"]],
-                    alert["title"],
-                )
-            else:
-                parsed_alerts[alert["title"]].locations.append(alert["data"])
-        all_alerts[date] = list(parsed_alerts.values())
-    return all_alerts
-
-
-async def check_and_publish_alerts(context: CallbackContext) -> None:
-    """Check for new alerts and notify subscribed users."""
-    global handled_ids
-    if len(handled_ids) > 1024:
-        handled_ids = handled_ids[:1024]
+
+async def send_to_shards(
+    bot: Bot, alert: AlertData, shards: set[int] | None = None
+) -> None:
+    """Match an alert and send it to the subscribed users, only of the given cluster shards if any are given."""
+    with match_seconds.time():
+        subscription_matcher.sync()
+        matches = subscription_matcher.match(alert.locations)
+        if shards is not None:
+            matches = {
+                user_id: locations
+                for user_id, locations in matches.items()
+                if cluster_leader.ring.shard_of(user_id) in shards
+            }
+    await alert_coalescer.submit(bot, alert, matches)
+
+
+async def check_and_publish_alerts(context: CallbackContext) -> bool:
+    """
+    Check for new alerts and notify subscribed users.
+    Returns whether there's an alert in the feed, so polling can speed up.
+    """
     alert = await get_active_alert()
     if alert is None:
-        return
+        return not is_feed_empty("alerts.json")
 
     add_alert_to_cache(alert)
+    alert_store.record(alert)
+    if alert.raised_at is not None:
+        poll_scheduler.record_detect_latency(time.time() - alert.raised_at)
 
     if len(alert.locations) == 0:
         logger.info(f"No locations to publish for alert {alert.id}, not yet expired...")
-        return
+        return True
+
+    published_shards: set[int] = set()
+    if CLUSTER_ROLE == LEADER_ROLE:
+        published_shards = cluster_leader.publish(alert)
+    if len(published_shards) < cluster_leader.ring.shards:
+        # Notify subscribed users, of the shards no worker got the alert for
+        await send_to_shards(
+            context.bot,
+            alert,
+            (
+                set(range(cluster_leader.ring.shards)) - published_shards
+                if published_shards
+                else None
+            ),
+        )
+    # Only once the alert is on its way, as learning new locations writes them to the database.
+    # Regions include the new locations from the next alert on
+    await gazetteer.learn(alert.locations)
+    # Regions are re-expanded with any learned location here rather than while matching the next alert
+    subscription_matcher.sync()
+    return True
 
-    # Notify subscribed users
-    for user_id, locations in get_all_subscriptions().items():
-        user_locs = [
-            loc for loc in alert.locations if any(map(lambda x: x in loc, locations))
-        ]
-        if any(loc in alert.locations for loc in locations) or "all" in locations:
-            message = (
-                f"🚨 {alert.title} 🚨"
-                + "\n"
-                + alert.description
-                + "\n\nמיקומים:\n"
-                + "\n".join(user_locs)
-            )
-            try:
-                await context.bot.send_message(chat_id=user_id, text=message)
-            except Exception as e:
-                logger.error(f"Failed to send message to user {user_id}: {e}")
+
+poll_scheduler = AdaptivePollScheduler(check_and_publish_alerts)
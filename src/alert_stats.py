@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from telegram.ext import CallbackContext
+
+from alert_store import HISTORY_ID_PREFIX, alert_store
+from config import STATS_IGNORED_CATEGORIES
+from database import get_alert_events_after
+from gazetteer import gazetteer
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES_FILE = Path(__file__).parent / "data" / "alert_categories.json"
+SECONDS_PER_DAY = 86_400
+SECONDS_PER_HOUR = 3_600
+HOURS_PER_DAY = 24
+
+
+def _local_times(times: np.ndarray) -> np.ndarray:
+    """Shift Unix times to local time, looking the UTC offset up once per day rather than once per event."""
+    days, inverse = np.unique(times // SECONDS_PER_DAY, return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.fromtimestamp(int(day) * SECONDS_PER_DAY + SECONDS_PER_DAY // 2)
+            .astimezone()
+            .utcoffset()
+            .total_seconds()
+            for day in days
+        ],
+        dtype=np.int64,
+    )
+    return times + offsets[inverse]
+
+
+class LocationStats:
+    """Alert statistics of a single location."""
+
+    def __init__(
+        self,
+        name: str,
+        total: int,
+        today: int,
+        week: int,
+        since: datetime,
+        last_alert_at: float,
+        hourly: list[int],
+        categories: list[tuple[str, int]],
+    ) -> None:
+        self.name = name
+        self.total = total
+        self.today = today
+        self.week = week
+        self.since = since
+        self.last_alert_at = last_alert_at
+        # Alerts in each local hour of the day
+        self.hourly = hourly
+        # Alert titles and their counts, most common first
+        self.categories = categories
+
+    def worst_hours(self, limit: int = 3) -> list[tuple[int, int]]:
+        """The hours of the day with the most alerts, and their counts."""
+        hours = sorted(range(HOURS_PER_DAY), key=lambda hour: -self.hourly[hour])
+        return [
+            (hour, self.hourly[hour]) for hour in hours[:limit] if self.hourly[hour]
+        ]
+
+
+class AlertStats:
+    """
+    Per-location aggregates of the alert event store. Each batch of new events is loaded as columns, with gazetteer
+    location IDs and titles as integer codes and int64 Unix times, and added with vectorized group-bys.
+    Refreshing only reads the events stored since the last refresh, so answering for a location is a few lookups.
+    The live feed and the alert history number categories differently, so events are ignored by the history
+    category of their title, as loaded from a data file and learned from the history events.
+    """
+
+    def __init__(
+        self, ignored_categories: frozenset[int] = STATS_IGNORED_CATEGORIES
+    ) -> None:
+        self._ignored_categories = np.array(sorted(ignored_categories), dtype=np.int64)
+        self._last_rowid = 0
+        self._lock = asyncio.Lock()
+        self.events = 0
+        # History category of each alert title
+        self._categories: dict[str, int] = {}
+        self._title_codes: dict[str, int] = {}
+        self._titles: list[str] = []
+        # Local day number of the first column of the daily counts
+        self._first_day: int | None = None
+        self._totals = np.zeros(0, dtype=np.int64)
+        self._first_alert = np.zeros(0, dtype=np.int64)
+        self._last_alert = np.zeros(0, dtype=np.int64)
+        self._hourly = np.zeros((0, HOURS_PER_DAY), dtype=np.int64)
+        self._daily = np.zeros((0, 0), dtype=np.int64)
+        self._by_title = np.zeros((0, 0), dtype=np.int64)
+
+    def load(self, file: Path = CATEGORIES_FILE) -> None:
+        with open(file, "r", encoding="utf-8") as f:
+            self._categories.update(json.load(f))
+
+    def _title_code(self, title: str) -> int:
+        code = self._title_codes.get(title)
+        if code is None:
+            code = self._title_codes[title] = len(self._titles)
+            self._titles.append(title)
+        return code
+
+    async def refresh(self) -> None:
+        """Add the events stored since the last refresh."""
+        async with self._lock:
+            await alert_store.flush()
+            rows = await asyncio.to_thread(get_alert_events_after, self._last_rowid)
+            if not rows:
+                return
+            rowids, alert_ids, categories, titles, names, raised_at = zip(*rows)
+            self._last_rowid = rowids[-1]
+            await gazetteer.learn(list(set(names)))
+            self._categories.update(
+                (title, category)
+                for alert_id, category, title in zip(alert_ids, categories, titles)
+                if alert_id.startswith(HISTORY_ID_PREFIX) and category is not None
+            )
+            location_ids = [gazetteer.get_id(name) for name in names]
+            known = np.fromiter(
+                (location_id is not None for location_id in location_ids),
+                dtype=bool,
+                count=len(rows),
+            )
+            self._add(
+                np.fromiter(
+                    (location_id or 0 for location_id in location_ids),
+                    dtype=np.int64,
+                    count=len(rows),
+                )[known],
+                np.fromiter(
+                    (
+                        self._categories.get(title, category or 0)
+                        for category, title in zip(categories, titles)
+                    ),
+                    dtype=np.int64,
+                    count=len(rows),
+                )[known],
+                np.fromiter(
+                    (self._title_code(title) for title in titles),
+                    dtype=np.int64,
+                    count=len(rows),
+                )[known],
+                np.array(raised_at, dtype=np.float64).astype(np.int64)[known],
+            )
+
+    async def refresh_job(self, context: CallbackContext) -> None:
+        try:
+            started = time.perf_counter()
+            events = self.events
+            await self.refresh()
+            if self.events != events:
+                logger.info(
+                    f"Added {self.events - events} alert events to the statistics in {(time.perf_counter() - started) * 1000:.1f}ms"
+                )
+        except Exception as e:
+            logger.exception(
+                f"Error refreshing alert statistics: {type(e).__name__}: {e}"
+            )
+
+    def _add(
+        self,
+        locations: np.ndarray,
+        categories: np.ndarray,
+        titles: np.ndarray,
+        times: np.ndarray,
+    ) -> None:
+        counted = ~np.isin(categories, self._ignored_categories)
+        locations, titles, times = locations[counted], titles[counted], times[counted]
+        if len(locations) == 0:
+            return
+        self.events += len(locations)
+
+        local_times = _local_times(times)
+        days = local_times // SECONDS_PER_DAY
+        hours = local_times % SECONDS_PER_DAY // SECONDS_PER_HOUR
+        first_day = int(days.min())
+        if self._first_day is None:
+            self._first_day = first_day
+        elif first_day < self._first_day:
+            self._daily = np.pad(
+                self._daily, ((0, 0), (self._first_day - first_day, 0))
+            )
+            self._first_day = first_day
+        days -= self._first_day
+
+        location_count = max(len(self._totals), int(locations.max()) + 1)
+        day_count = max(self._daily.shape[1], int(days.max()) + 1)
+        title_count = max(self._by_title.shape[1], int(titles.max()) + 1)
+        new_locations = location_count - len(self._totals)
+        self._totals = np.pad(self._totals, (0, new_locations))
+        self._first_alert = np.pad(
+            self._first_alert,
+            (0, new_locations),
+            constant_values=np.iinfo(np.int64).max,
+        )
+        self._last_alert = np.pad(self._last_alert, (0, new_locations))
+        self._hourly = np.pad(self._hourly, ((0, new_locations), (0, 0)))
+        self._daily = np.pad(
+            self._daily, ((0, new_locations), (0, day_count - self._daily.shape[1]))
+        )
+        self._by_title = np.pad(
+            self._by_title,
+            ((0, new_locations), (0, title_count - self._by_title.shape[1])),
+        )
+
+        # Group-bys over flattened (location, key) codes
+        self._totals += np.bincount(locations, minlength=location_count)
+        self._hourly += np.bincount(
+            locations * HOURS_PER_DAY + hours, minlength=location_count * HOURS_PER_DAY
+        ).reshape(location_count, HOURS_PER_DAY)
+        self._daily += np.bincount(
+            locations * day_count + days, minlength=location_count * day_count
+        ).reshape(location_count, day_count)
+        self._by_title += np.bincount(
+            locations * title_count + titles,
+            minlength=location_count * title_count,
+        ).reshape(location_count, title_count)
+        np.minimum.at(self._first_alert, locations, times)
+        np.maximum.at(self._last_alert, locations, times)
+
+    def get(self, location_id: int, now: float | None = None) -> LocationStats | None:
+        """Get the statistics of a location, or None if it never had an alert."""
+        if location_id >= len(self._totals) or self._totals[location_id] == 0:
+            return None
+        now = time.time() if now is None else now
+        today = (
+            int(_local_times(np.array([int(now)]))[0]) // SECONDS_PER_DAY
+            - self._first_day
+        )
+        daily = self._daily[location_id]
+        by_title = self._by_title[location_id]
+        titles = np.flatnonzero(by_title)
+        return LocationStats(
+            name=gazetteer.get_name(location_id),
+            total=int(self._totals[location_id]),
+            today=int(daily[today]) if 0 <= today < len(daily) else 0,
+            week=int(daily[max(0, today - 6) : max(0, today + 1)].sum()),
+            since=datetime.fromtimestamp(int(self._first_alert[location_id])),
+            last_alert_at=float(self._last_alert[location_id]),
+            hourly=self._hourly[location_id].tolist(),
+            categories=[
+                (self._titles[title], int(count))
+                for title, count in sorted(
+                    zip(titles, by_title[titles]), key=lambda item: -item[1]
+                )
+            ],
+        )
+
+    def __str__(self):
+        return (
+            f"AlertStats(events={self.events}, locations={int(np.count_nonzero(self._totals))}, "
+            f"days={self._daily.shape[1]})"
+        )
+
+
+alert_stats = AlertStats()
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+
+from alert_data import AlertData
+from config import ALERT_STORE_BATCH, ALERT_STORE_MATCH_TOLERANCE
+from database import (
+    AlertEvent,
+    add_alert_events,
+    add_history_events,
+    get_alert_events,
+)
+from metrics import alert_events_stored
+
+logger = logging.getLogger(__name__)
+
+
+# Alert events from the alert history, which numbers categories differently than the live feed
+HISTORY_ID_PREFIX = "history:"
+
+
+def _category(alert: AlertData) -> int | None:
+    try:
+        return int(alert.category)
+    except (TypeError, ValueError):
+        return None
+
+
+def _history_id(alert: AlertData, timestamp: float) -> str:
+    key = f"{alert.title}\0{alert.category}\0{int(timestamp)}"
+    return f"{HISTORY_ID_PREFIX}{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+
+
+def _group(rows: list[AlertEvent]) -> list[AlertData]:
+    """Group events back into alerts, by ID and title, in the order they were raised."""
+    alerts: dict[tuple[str, str], AlertData] = {}
+    for alert_id, category, title, location, _ in rows:
+        alert = alerts.get((alert_id, title))
+        if alert is None:
+            alerts[(alert_id, title)] = AlertData(
+                alert_id, str(category), title, [location], title
+            )
+        else:
+            alert.locations.append(location)
+    return list(alerts.values())
+
+
+class AlertStore:
+    """
+    Append-only store of alert events, one row per location of an alert, indexed by location and time.
+    Alerts from the live feed are buffered and written in batches by the database writer thread, so recording
+    never holds up polling, and periodic syncs of the alert history fill in whatever polling missed.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = ALERT_STORE_BATCH,
+        match_tolerance: float = ALERT_STORE_MATCH_TOLERANCE,
+    ) -> None:
+        self._batch_size = batch_size
+        self._match_tolerance = match_tolerance
+        self._pending: list[AlertEvent] = []
+        self._flush_task: asyncio.Task | None = None
+        self.recorded = 0
+        self.synced = 0
+
+    def record(self, alert: AlertData) -> None:
+        """Queue the locations of an alert seen on the live feed to be stored."""
+        raised_at = alert.raised_at or time.time()
+        category = _category(alert)
+        self._pending.extend(
+            (alert.id, category, alert.title, location, raised_at)
+            for location in alert.locations
+        )
+        if len(self._pending) >= self._batch_size and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_now())
+
+    async def _flush_now(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._flush_task = None
+
+    async def flush(self) -> None:
+        """Store every queued event."""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            added = await add_alert_events(rows)
+        except Exception as e:
+            logger.error(f"Error storing {len(rows)} alert events: {e}")
+            return
+        self.recorded += added
+        alert_events_stored.inc(added)
+
+    async def flush_job(self, context) -> None:
+        await self.flush()
+
+    async def add_history(
+        self, history: list[tuple[datetime, list[AlertData]]]
+    ) -> None:
+        """Store the alerts of the alert history which the live feed didn't."""
+        rows: list[AlertEvent] = []
+        for raised_at, alerts in history:
+            timestamp = raised_at.timestamp()
+            for alert in alerts:
+                # History alerts get random IDs, these stay the same between syncs and differ between titles
+                alert_id = _history_id(alert, timestamp)
+                category = _category(alert)
+                rows.extend(
+                    (alert_id, category, alert.title, location, timestamp)
+                    for location in alert.locations
+                )
+        if not rows:
+            return
+        # Anything the live feed already saw is written first, so it's matched rather than duplicated
+        await self.flush()
+        added = await add_history_events(rows, self._match_tolerance)
+        self.synced += added
+        alert_events_stored.inc(added)
+        if added:
+            logger.info(f"Stored {added} alert events missed by the live feed")
+
+    async def get_alerts_between(
+        self,
+        since: datetime,
+        until: datetime | None = None,
+        location: str | None = None,
+    ) -> list[AlertData]:
+        """Get the alerts raised in [since, until), only with the given location if one is given."""
+        await self.flush()
+        rows = await asyncio.to_thread(
+            get_alert_events,
+            since.timestamp(),
+            until.timestamp() if until else float("inf"),
+            location,
+        )
+        return _group(rows)
+
+    async def get_active_alerts(
+        self, minutes: int, location: str | None = None
+    ) -> list[AlertData]:
+        """Get all alerts raised in the last given minutes."""
+        return await self.get_alerts_between(
+            datetime.now() - timedelta(minutes=minutes), location=location
+        )
+
+    def __str__(self):
+        return (
+            f"AlertStore(recorded={self.recorded}, synced={self.synced}, "
+            f"pending={len(self._pending)})"
+        )
+
+
+alert_store = AlertStore()
@@ -1,21 +1,63 @@
+import asyncio
+import functools
 import logging
-import signal
+import time
 
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler
+from telegram.ext import (
+    Application,
+    CallbackContext,
+    CommandHandler,
+    InlineQueryHandler,
+)
 
-from alert_monitor import check_and_publish_alerts
-from config import ALERT_CHECK_INTERVAL, DEV_MODE, SUPERUSER_USER_ID, TELEGRAM_BOT_TOKEN
-from database import add_admin, close_db
+from alert_coalescer import alert_coalescer
+from dispatcher import dispatcher
+from alert_history import backfill_alert_store, sync_alert_store
+from alert_stats import alert_stats
+from alert_store import alert_store
+from alert_monitor import expire_alert_caches, poll_scheduler, send_to_shards
+from cluster import LEADER_ROLE, cluster_leader, leader_lease
+from config import (
+    ALERT_STORE_FLUSH_INTERVAL,
+    ALERT_STORE_SYNC_INTERVAL,
+    CACHE_EXPIRY_TICK,
+    CLUSTER_ROLE,
+    DEV_MODE,
+    FETCH_STATS_INTERVAL,
+    STATS_REFRESH_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    SHUTDOWN_DRAIN_TIMEOUT,
+    STATE_SNAPSHOT_INTERVAL,
+    SUPERUSER_USER_ID,
+    TELEGRAM_BASE_URL,
+    TELEGRAM_BOT_TOKEN,
+    WEBHOOK_URL,
+)
+from database import add_admin, close_db, load_snapshot
+from fetch_from_oref import close_session, endpoints, fetch_stats, start_session
+from gazetteer import gazetteer
+from log_sink import log_sink
+from regions import regions
+from state_snapshot import state_snapshot
+from metrics import start_metrics_server
+from subscription_matcher import subscription_matcher
+from webhook import run_webhook
 from handlers import (
     get_active_alerts,
     get_subscriptions,
     get_users,
+    stats,
     send_message_to_all,
     start,
     help_command,
+    list_regions,
     subscribe,
+    subscribe_region,
+    suggest_locations,
     unsubscribe,
+    unsubscribe_region,
     list_subscriptions,
 )
 
@@ -26,31 +68,93 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 
-def signal_handler(signum, frame):
-    """Handle shutdown signals."""
-    logger.info("Received shutdown signal. Cleaning up...")
-    close_db()
-    exit(0)
-
-
 def setup():
-    # Set up signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    # Shutdown signals are handled by the running application, which cleans up in post_stop and post_shutdown
+    load_snapshot()
+    gazetteer.load()
+    regions.load()
+    alert_stats.load()
+    state_snapshot.restore()
     # Add superuser to admins
     add_admin(SUPERUSER_USER_ID)
 
 
-def main():
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def post_init(application: Application) -> None:
+    """Warm up the OREF client and the subscription matcher before the first poll."""
+    subscription_matcher.sync()
+    log_sink.start()
+    if CLUSTER_ROLE == LEADER_ROLE:
+        await cluster_leader.start(
+            leader_lease.epoch, functools.partial(send_to_shards, application.bot)
+        )
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await start_metrics_server(
+            METRICS_HOST, METRICS_PORT
+        )
+    await start_session()
+
+
+async def post_stop(application: Application) -> None:
+    """
+    Send the alerts still held by the coalescer and wait for the ones being sent, while the bot can still
+    send them, then save the dedup state.
+    """
+    await alert_coalescer.close(application.bot)
+    await dispatcher.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    await state_snapshot.save()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Release the OREF client and flush stored alerts and debug records once the application shut down."""
+    await alert_store.flush()
+    await cluster_leader.close()
+    await close_session()
+    await log_sink.close()
+    if "metrics_server" in application.bot_data:
+        await application.bot_data["metrics_server"].cleanup()
+
+
+async def log_stats(context: CallbackContext) -> None:
+    logger.info(f"OREF fetch latency: {fetch_stats}")
+    if len(endpoints) > 1:
+        for endpoint in endpoints:
+            logger.info(f"OREF endpoint: {endpoint}")
+    logger.info(f"Polling: {poll_scheduler}")
+    logger.info(f"Coalescing: {alert_coalescer}")
+    logger.info(f"Alert store: {alert_store}")
+    logger.info(f"Statistics: {alert_stats}")
+    logger.info(f"Dedup state: {state_snapshot}")
+    if CLUSTER_ROLE == LEADER_ROLE:
+        logger.info(f"Cluster: {cluster_leader}")
+
+
+def build_application() -> Application:
+    """Create the application with all the command handlers, without any jobs."""
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_BASE_URL)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("subscribe", subscribe, has_args=True))
     application.add_handler(CommandHandler("unsubscribe", unsubscribe, has_args=True))
+    application.add_handler(CommandHandler("regions", list_regions))
+    application.add_handler(
+        CommandHandler("subscribe_region", subscribe_region, has_args=True)
+    )
+    application.add_handler(
+        CommandHandler("unsubscribe_region", unsubscribe_region, has_args=True)
+    )
+    application.add_handler(InlineQueryHandler(suggest_locations))
     application.add_handler(CommandHandler("list", list_subscriptions))
+    application.add_handler(CommandHandler("stats", stats, has_args=True))
     application.add_handler(CommandHandler("get_users", get_users))
     application.add_handler(CommandHandler("get_subscriptions", get_subscriptions))
     application.add_handler(
@@ -59,15 +163,41 @@ def main():
     application.add_handler(
         CommandHandler("get_active_alerts", get_active_alerts, has_args=False)
     )
+    return application
+
+
+def main(started_at: float | None = None):
+    application = build_application()
+    poll_scheduler.start(application.job_queue, started_at)
     application.job_queue.run_repeating(
-        check_and_publish_alerts, interval=ALERT_CHECK_INTERVAL
+        state_snapshot.save_job, interval=STATE_SNAPSHOT_INTERVAL
     )
-
-    application.run_polling()
+    application.job_queue.run_repeating(expire_alert_caches, interval=CACHE_EXPIRY_TICK)
+    application.job_queue.run_repeating(
+        alert_store.flush_job, interval=ALERT_STORE_FLUSH_INTERVAL
+    )
+    application.job_queue.run_once(backfill_alert_store, when=0)
+    application.job_queue.run_repeating(
+        sync_alert_store, interval=ALERT_STORE_SYNC_INTERVAL
+    )
+    application.job_queue.run_repeating(
+        alert_stats.refresh_job, interval=STATS_REFRESH_INTERVAL
+    )
+    application.job_queue.run_repeating(
+        log_stats, interval=FETCH_STATS_INTERVAL, first=FETCH_STATS_INTERVAL
+    )
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
     close_db()
 
 
 if __name__ == "__main__":
+    if CLUSTER_ROLE == LEADER_ROLE:
+        # Standby leaders block here until the current leader goes away
+        leader_lease.acquire()
+    started_at = time.monotonic()
     setup()
-    main()
+    main(started_at)
@@ -0,0 +1,405 @@
+import asyncio
+import bisect
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+from telegram import Bot
+
+from alert_coalescer import alert_coalescer
+from alert_data import AlertData
+from alert_dedup import AlertDeduplicator
+from config import (
+    CLUSTER_LEASE_FILE,
+    CLUSTER_RECONNECT_DELAY,
+    CLUSTER_SHARDS,
+    CLUSTER_SOCKET,
+)
+from database import get_subscriptions_version, load_snapshot
+from gazetteer import gazetteer
+from metrics import match_seconds
+from subscription_matcher import subscription_matcher
+
+logger = logging.getLogger(__name__)
+
+LEADER_ROLE = "leader"
+WORKER_ROLE = "worker"
+VIRTUAL_NODES = 64
+# How long a worker has to acknowledge an alert before its shard is sent to locally
+ACK_TIMEOUT = 2.0
+# Alerts are sent as a single line, which can get long with thousands of locations
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class HashRing:
+    """
+    Consistent hash ring of shards, so changing the number of shards only moves a fraction of the users.
+    """
+
+    def __init__(
+        self, shards: int = CLUSTER_SHARDS, virtual_nodes: int = VIRTUAL_NODES
+    ):
+        self.shards = shards
+        points = sorted(
+            (self._hash(f"{shard}-{node}"), shard)
+            for shard in range(shards)
+            for node in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def shard_of(self, user_id: int) -> int:
+        index = bisect.bisect(self._hashes, self._hash(str(user_id)))
+        return self._shards[index % len(self._shards)]
+
+
+class LeaderLease:
+    """
+    Only one leader may poll OREF, the others wait as standbys until the lease is free.
+    The lease is an exclusive lock on a file, which the OS releases as soon as the holding process dies.
+    Every new holder writes an increased epoch to the file, which fences off messages from older leaders.
+    """
+
+    def __init__(self, path: str = CLUSTER_LEASE_FILE) -> None:
+        self._path = path
+        self._file = None
+        self.epoch = 0
+
+    def acquire(self) -> int:
+        """Wait until the lease is free, returning the new epoch."""
+        self._file = open(self._path, "a+")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another leader holds the lease, waiting as a standby")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._file.seek(0)
+        previous = self._file.read().strip()
+        self.epoch = (int(previous) if previous else 0) + 1
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(self.epoch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        logger.info(f"Acquired the leader lease, epoch {self.epoch}")
+        return self.epoch
+
+    def release(self) -> None:
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def _encode(message: dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode() + b"\n"
+
+
+def _acknowledge(writer: asyncio.StreamWriter, sequence: int) -> None:
+    if not writer.is_closing():
+        writer.write(_encode({"ack": sequence}))
+
+
+class ClusterLeader:
+    """
+    Publishes alert deltas to the workers connected over a Unix socket.
+    Each worker announces the shard it owns, and the leader reports which shards got the alert,
+    so alerts of users whose shard has no worker can still be sent locally.
+    Publishing only buffers the alert for each worker, which acknowledges it once it's handed to its coalescer.
+    A worker which disconnects or doesn't acknowledge an alert within ACK_TIMEOUT is dropped, and the leader
+    re-sends the alerts it didn't acknowledge to the users of its shard itself.
+    """
+
+    def __init__(self, socket_path: str = CLUSTER_SOCKET) -> None:
+        self._socket_path = socket_path
+        self._server: asyncio.AbstractServer | None = None
+        self._workers: dict[asyncio.StreamWriter, int] = {}
+        # Alerts sent to each worker and not acknowledged yet, by sequence number, with when they were sent
+        self._unacked: dict[
+            asyncio.StreamWriter, dict[int, tuple[float, AlertData]]
+        ] = {}
+        self._resend: Callable[[AlertData, set[int]], Awaitable[None]] | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._sequence = 0
+        self.ring = HashRing()
+        self.epoch = 0
+        self.published = 0
+        self.resent = 0
+
+    async def start(
+        self, epoch: int, resend: Callable[[AlertData, set[int]], Awaitable[None]]
+    ) -> None:
+        """Start accepting workers. Alerts a dropped worker didn't acknowledge are passed to resend with its shard."""
+        self.epoch = epoch
+        self._resend = resend
+        # A socket left behind by a dead leader would make binding fail
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._server = await asyncio.start_unix_server(
+            self._handle_worker, self._socket_path
+        )
+        self._track(self._watch())
+        logger.info(f"Publishing alerts to workers on {self._socket_path}")
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._workers):
+            writer.close()
+        self._workers.clear()
+        self._unacked.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        await self._server.wait_closed()
+        self._server = None
+
+    def _track(self, coroutine: Awaitable[None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logger.error(
+                f"Error in the cluster leader: {type(error).__name__}: {error}",
+                exc_info=error,
+            )
+
+    async def _handle_worker(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            hello = json.loads(await reader.readline())
+            if hello.get("shards") != self.ring.shards:
+                logger.error(
+                    f"Worker expects {hello.get('shards')} shards instead of {self.ring.shards}, rejecting it"
+                )
+                writer.close()
+                return
+            self._workers[writer] = hello["shard"]
+            self._unacked[writer] = {}
+            logger.info(f"Worker of shard {hello['shard']} connected")
+            while line := await reader.readline():
+                self._unacked.get(writer, {}).pop(json.loads(line)["ack"], None)
+        except (ValueError, KeyError, ConnectionError) as e:
+            logger.warning(f"Bad worker connection: {type(e).__name__}: {e}")
+        finally:
+            if writer in self._workers:
+                self._drop(writer, "disconnected")
+            writer.close()
+
+    def _drop(self, writer: asyncio.StreamWriter, reason: str) -> None:
+        """Drop a worker, and re-send the alerts it didn't acknowledge to its shard locally."""
+        shard = self._workers.pop(writer)
+        unacked = self._unacked.pop(writer, {})
+        logger.warning(
+            f"Dropping worker of shard {shard}: {reason}, re-sending {len(unacked)} alerts locally"
+        )
+        # Discards anything still buffered, so the worker can't get an alert which is re-sent
+        writer.transport.abort()
+        for _, alert in unacked.values():
+            self.resent += 1
+            self._track(self._resend(alert, {shard}))
+
+    async def _watch(self) -> None:
+        """Drop workers which are too slow to acknowledge alerts."""
+        while True:
+            await asyncio.sleep(ACK_TIMEOUT / 4)
+            deadline = time.monotonic() - ACK_TIMEOUT
+            for writer, unacked in list(self._unacked.items()):
+                if (
+                    unacked
+                    and min(sent_at for sent_at, _ in unacked.values()) < deadline
+                ):
+                    self._drop(writer, f"no acknowledgement within {ACK_TIMEOUT}s")
+
+    def publish(self, alert: AlertData) -> set[int]:
+        """Send an alert delta to every worker, returning the shards which got it, without waiting on any."""
+        self._sequence += 1
+        data = _encode(
+            {
+                "epoch": self.epoch,
+                "sequence": self._sequence,
+                "subscriptions_version": get_subscriptions_version(),
+                "alert": {
+                    "id": alert.id,
+                    "cat": alert.category,
+                    "title": alert.title,
+                    "data": alert.locations,
+                    "desc": alert.description,
+                },
+            }
+        )
+        now = time.monotonic()
+        shards = set()
+        for writer, shard in list(self._workers.items()):
+            if writer.is_closing():
+                self._drop(writer, "connection closed")
+                continue
+            writer.write(data)
+            self._unacked[writer][self._sequence] = (now, alert)
+            shards.add(shard)
+        self.published += 1
+        return shards
+
+    def __str__(self):
+        return (
+            f"ClusterLeader(epoch={self.epoch}, workers={sorted(self._workers.values())}, "
+            f"published={self.published}, resent={self.resent})"
+        )
+
+
+class ClusterWorker:
+    """
+    Matches and sends the alerts published by the leader, for the users of a single shard.
+    Locations already handled for an alert ID are dropped, so an alert re-published by a new leader isn't sent twice.
+    Alerts are fenced and deduplicated in the order they're read, then matched and sent in the background,
+    so a slow alert doesn't hold up reading the next ones, and acknowledged once handed to the coalescer.
+    """
+
+    def __init__(
+        self,
+        shard: int,
+        socket_path: str = CLUSTER_SOCKET,
+        reconnect_delay: float = CLUSTER_RECONNECT_DELAY,
+    ) -> None:
+        self.shard = shard
+        self.ring = HashRing()
+        self._socket_path = socket_path
+        self._reconnect_delay = reconnect_delay
+        self._dedup = AlertDeduplicator()
+        self._epoch = 0
+        self._subscriptions_version: tuple[int, int] | None = None
+        self._reload_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        self.received = 0
+        self.fenced = 0
+
+    async def run(self, bot: Bot) -> None:
+        """Handle alerts from the current leader forever, reconnecting whenever it goes away."""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self._socket_path, limit=MAX_MESSAGE_BYTES
+                )
+            except (ConnectionError, FileNotFoundError) as e:
+                logger.debug(f"No leader to connect to: {e}")
+                await asyncio.sleep(self._reconnect_delay)
+                continue
+            logger.info(f"Connected to the leader as shard {self.shard}")
+            writer.write(_encode({"shard": self.shard, "shards": self.ring.shards}))
+            await writer.drain()
+            try:
+                while line := await reader.readline():
+                    if not line.endswith(b"\n"):
+                        # Cut off by the leader dropping this worker, it re-sends the alert itself
+                        logger.warning("Ignoring an alert cut off by the leader")
+                        break
+                    try:
+                        message = json.loads(line)
+                        self._receive(bot, writer, message)
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.error(
+                            f"Ignoring a malformed message from the leader: {type(e).__name__}: {e}"
+                        )
+            except ConnectionError as e:
+                logger.warning(f"Lost the connection to the leader: {e}")
+            finally:
+                writer.close()
+            await asyncio.sleep(self._reconnect_delay)
+
+    def _receive(
+        self, bot: Bot, writer: asyncio.StreamWriter, message: dict[str, Any]
+    ) -> None:
+        sequence = message["sequence"]
+        if message["epoch"] < self._epoch:
+            self.fenced += 1
+            logger.warning(
+                f"Ignoring an alert from the leader of epoch {message['epoch']}, current is {self._epoch}"
+            )
+            _acknowledge(writer, sequence)
+            return
+        self._epoch = message["epoch"]
+        self.received += 1
+        data = message["alert"]
+        new_locations = self._dedup.delta(data["id"], data["data"])
+        if not new_locations:
+            _acknowledge(writer, sequence)
+            return
+        alert = AlertData(
+            data["id"], data["cat"], data["title"], new_locations, data["desc"]
+        )
+        task = asyncio.create_task(
+            self._handle(
+                bot,
+                writer,
+                sequence,
+                alert,
+                (message["epoch"], message["subscriptions_version"]),
+            )
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._handled)
+
+    def _handled(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logger.error(
+                f"Error handling an alert: {type(error).__name__}: {error}",
+                exc_info=error,
+            )
+
+    async def _handle(
+        self,
+        bot: Bot,
+        writer: asyncio.StreamWriter,
+        sequence: int,
+        alert: AlertData,
+        subscriptions_version: tuple[int, int],
+    ) -> None:
+        # Subscriptions are written by the leader, reload them whenever it has a newer version
+        async with self._reload_lock:
+            if subscriptions_version != self._subscriptions_version:
+                await asyncio.to_thread(load_snapshot)
+                self._subscriptions_version = subscriptions_version
+
+        with match_seconds.time():
+            subscription_matcher.sync()
+            matches = {
+                user_id: locations
+                for user_id, locations in subscription_matcher.match(
+                    alert.locations
+                ).items()
+                if self.ring.shard_of(user_id) == self.shard
+            }
+        await alert_coalescer.submit(bot, alert, matches)
+        _acknowledge(writer, sequence)
+        await gazetteer.learn(alert.locations)
+        subscription_matcher.sync()
+
+    async def drain(self) -> None:
+        """Wait for the alerts being matched to be handed to the coalescer."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def __str__(self):
+        return (
+            f"ClusterWorker(shard={self.shard}/{self.ring.shards}, epoch={self._epoch}, "
+            f"received={self.received}, fenced={self.fenced})"
+        )
+
+
+cluster_leader = ClusterLeader()
+leader_lease = LeaderLease()
@@ -16,15 +16,121 @@ logging.getLogger("temporal_cache").setLevel(logging.DEBUG)
 
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot")
 
 SUPERUSER_USER_ID = int(os.getenv("SUPERUSER_ID"))
 
 ALERT_CHECK_INTERVAL = int(os.getenv("ALERT_CHECK_INTERVAL"))
 
 SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH")
+SQLITE_READ_CONNECTIONS = int(os.getenv("SQLITE_READ_CONNECTIONS", 2))
+# Most writes committed together by the writer thread
+SQLITE_WRITE_BATCH = int(os.getenv("SQLITE_WRITE_BATCH", 256))
 
 DEV_MODE = False  # Need to make this a proper env variable
 
 DEBUG_FOLDER = os.getenv("DEBUG_FOLDER")
 
 CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", 180))  # Default to 3 minutes if not set
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10_000))  # Per alert title
+CACHE_EXPIRY_TICK = float(os.getenv("CACHE_EXPIRY_TICK", 5))  # Seconds
+
+# OREF HTTP client
+OREF_BASE_URL = os.getenv("OREF_BASE_URL", "https://www.oref.org.il").rstrip("/")
+# Comma separated hosts serving the same files, requests are hedged to them when OREF_BASE_URL is slow
+OREF_MIRRORS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OREF_MIRRORS", "").split(",")
+    if url.strip()
+]
+OREF_HEDGE_MIN_DELAY = float(os.getenv("OREF_HEDGE_MIN_DELAY", 0.05))  # Seconds
+# Until enough latencies were seen to trust an endpoint's p95
+OREF_HEDGE_DEFAULT_DELAY = float(os.getenv("OREF_HEDGE_DEFAULT_DELAY", 0.5))  # Seconds
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 4))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+# Seconds between fetch latency log lines
+FETCH_STATS_INTERVAL = int(os.getenv("FETCH_STATS_INTERVAL", 300))
+
+# Telegram dispatch
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", 16))
+# Messages per second, for the whole bot and for a single chat
+DISPATCH_GLOBAL_RATE = float(os.getenv("DISPATCH_GLOBAL_RATE", 30))
+DISPATCH_PER_CHAT_RATE = float(os.getenv("DISPATCH_PER_CHAT_RATE", 1))
+DISPATCH_MAX_RETRIES = int(os.getenv("DISPATCH_MAX_RETRIES", 3))
+
+# Alert history
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", 10))  # Seconds
+ACTIVE_ALERTS_WINDOW = int(os.getenv("ACTIVE_ALERTS_WINDOW", 10))  # Minutes
+
+# Alert event store, fed by the live feed and synced with the alert history
+ALERT_STORE_FLUSH_INTERVAL = float(
+    os.getenv("ALERT_STORE_FLUSH_INTERVAL", 1)
+)  # Seconds
+ALERT_STORE_BATCH = int(os.getenv("ALERT_STORE_BATCH", 500))  # Events
+# Should be well under ACTIVE_ALERTS_WINDOW, which is how far back each sync looks
+ALERT_STORE_SYNC_INTERVAL = float(os.getenv("ALERT_STORE_SYNC_INTERVAL", 60))  # Seconds
+# History rows within this many seconds of a live event of the same title and location are the same alert
+ALERT_STORE_MATCH_TOLERANCE = float(os.getenv("ALERT_STORE_MATCH_TOLERANCE", 120))
+
+# Alert statistics, kept up to date with the alert store
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", 30))  # Seconds
+# Alert categories not counted, numbered as in the alert history, the all clear notices by default
+STATS_IGNORED_CATEGORIES = frozenset(
+    int(category)
+    for category in os.getenv("STATS_IGNORED_CATEGORIES", "13").split(",")
+    if category.strip()
+)
+
+# Debug log sink
+LOG_SINK_QUEUE_SIZE = int(os.getenv("LOG_SINK_QUEUE_SIZE", 1000))
+LOG_SINK_SEGMENT_BYTES = int(os.getenv("LOG_SINK_SEGMENT_BYTES", 5 * 1024 * 1024))
+LOG_SINK_SEGMENT_SECONDS = int(os.getenv("LOG_SINK_SEGMENT_SECONDS", 3600))
+LOG_SINK_COMPRESS = os.getenv("LOG_SINK_COMPRESS", "false").lower() == "true"
+
+# Adaptive polling, ALERT_CHECK_INTERVAL is used while quiet
+ACTIVE_CHECK_INTERVAL = float(os.getenv("ACTIVE_CHECK_INTERVAL", 0.5))  # Seconds
+ACTIVE_HOLD_SECONDS = float(os.getenv("ACTIVE_HOLD_SECONDS", 120))
+
+# Metrics endpoint, disabled unless a port is set
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Alert ID dedup state bounds
+DEDUP_MAX_ALERTS = int(os.getenv("DEDUP_MAX_ALERTS", 1024))
+DEDUP_MAX_LOCATIONS = int(os.getenv("DEDUP_MAX_LOCATIONS", 100_000))
+
+# Seconds between snapshots of the alert dedup state, restored when the bot restarts
+STATE_SNAPSHOT_INTERVAL = float(os.getenv("STATE_SNAPSHOT_INTERVAL", 10))
+# Seconds to wait on shutdown for alerts which are still being sent
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30))
+
+# Alert coalescing, merges alerts within the window into one message per user. Disabled when 0
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW_MS", 0)) / 1000  # Seconds
+# Rendered alert messages kept, by title, description and locations
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 1024))
+# Alert categories sent right away, rockets and missiles by default
+COALESCE_BYPASS_CATEGORIES = frozenset(
+    int(category)
+    for category in os.getenv("COALESCE_BYPASS_CATEGORIES", "1").split(",")
+    if category.strip()
+)
+
+# Scale-out, a leader polls OREF and publishes alerts to workers which each send to a shard of the users.
+# Empty to run everything in one process
+CLUSTER_ROLE = os.getenv("CLUSTER_ROLE", "")
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET", "cluster.sock")
+CLUSTER_LEASE_FILE = os.getenv("CLUSTER_LEASE_FILE", "cluster.lease")
+CLUSTER_SHARDS = int(os.getenv("CLUSTER_SHARDS", 1))
+CLUSTER_SHARD = int(os.getenv("CLUSTER_SHARD", 0))  # Of a worker
+CLUSTER_RECONNECT_DELAY = float(os.getenv("CLUSTER_RECONNECT_DELAY", 1))  # Seconds
+# Workers may send through their own bots, to get their own rate limits
+WORKER_BOT_TOKEN = os.getenv("WORKER_BOT_TOKEN", TELEGRAM_BOT_TOKEN)
+
+# Webhook mode, the bot long polls for updates unless a public URL is set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
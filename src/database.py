@@ -1,29 +1,258 @@
+import asyncio
 import logging
+import queue
 import sqlite3
 import threading
-from typing import Set, Dict, Optional
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Set
 
-from config import SQLITE_DB_PATH
+from config import SQLITE_DB_PATH, SQLITE_READ_CONNECTIONS, SQLITE_WRITE_BATCH
 
 logger = logging.getLogger(__name__)
 
+SUBSCRIPTION_CHANGES_KEPT = 1024
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT_MS = 5000
 
-# Private singleton instance
-connections: dict[int, Optional[sqlite3.Connection]] = {}
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    # WAL stays consistent with NORMAL, only the last commits may be lost on power failure
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
 
+# Statements are kept as constants so each connection's statement cache prepares them once
+INSERT_SUBSCRIPTION = "INSERT OR IGNORE INTO subscriptions (user_id, location, location_id) VALUES (?, ?, ?)"
+DELETE_SUBSCRIPTION = "DELETE FROM subscriptions WHERE user_id = ? AND location = ?"
+SELECT_SUBSCRIPTIONS = "SELECT user_id, location, location_id FROM subscriptions"
+INSERT_ADMIN = "INSERT OR IGNORE INTO admins (user_id) VALUES (?)"
+SELECT_ADMINS = "SELECT user_id FROM admins"
+SELECT_LOCATIONS = "SELECT id, name FROM locations ORDER BY id"
+SELECT_LOCATION = "SELECT id, name FROM locations WHERE name = ?"
+INSERT_LOCATION = "INSERT OR IGNORE INTO locations (name) VALUES (?)"
+INSERT_ALERT_EVENT = "INSERT OR IGNORE INTO alert_events (alert_id, category, title, location, raised_at) VALUES (?, ?, ?, ?, ?)"
+# History rows have no alert ID, so they're skipped when the live feed already recorded the same alert around that time
+INSERT_HISTORY_EVENT = """
+    INSERT OR IGNORE INTO alert_events (alert_id, category, title, location, raised_at)
+    SELECT ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (
+        SELECT 1 FROM alert_events WHERE location = ? AND raised_at BETWEEN ? AND ? AND title = ?
+    )
+"""
+SELECT_ALERT_EVENTS = "SELECT alert_id, category, title, location, raised_at FROM alert_events WHERE raised_at >= ? AND raised_at < ? ORDER BY raised_at"
+UPSERT_STATE = "INSERT OR REPLACE INTO state (name, saved_at, data) VALUES (?, ?, ?)"
+SELECT_STATE = "SELECT saved_at, data FROM state WHERE name = ?"
+SELECT_ALERT_EVENTS_AFTER = "SELECT rowid, alert_id, category, title, location, raised_at FROM alert_events WHERE rowid > ? ORDER BY rowid"
+SELECT_LOCATION_ALERT_EVENTS = "SELECT alert_id, category, title, location, raised_at FROM alert_events WHERE location = ? AND raised_at >= ? AND raised_at < ? ORDER BY raised_at"
 
-def get_db(thread_id=threading.get_ident()) -> sqlite3.Connection:
-    """Get or create the singleton database connection."""
-    if thread_id not in connections:
-        connections[thread_id] = sqlite3.connect(SQLITE_DB_PATH)
-        _init_tables()
-    return connections[thread_id]
+WriteJob = tuple[
+    Callable[[sqlite3.Connection], Any], Callable[[Any], None] | None, Future
+]
 
 
-def _init_tables() -> None:
+def _connect() -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        SQLITE_DB_PATH,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+class _Writer:
+    """
+    Owns the only writing connection, on a dedicated thread.
+    Queued writes are group committed, each in its own savepoint so a failing write doesn't undo the others,
+    and their commit callbacks run in queue order once the batch is durable.
+    """
+
+    def __init__(self, batch_size: int = SQLITE_WRITE_BATCH) -> None:
+        self._batch_size = batch_size
+        self._queue: queue.Queue[WriteJob | None] = queue.Queue()
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+        self.commits = 0
+        self.writes = 0
+        self._thread = threading.Thread(
+            target=self._run, name="sqlite-writer", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def submit(
+        self,
+        write: Callable[[sqlite3.Connection], Any],
+        on_commit: Callable[[Any], None] | None = None,
+    ) -> Future:
+        future = Future()
+        self._queue.put((write, on_commit, future))
+        return future
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            connection = _connect()
+            # Savepoints manage the transactions
+            connection.isolation_level = None
+            _init_tables(connection)
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [job for job in batch if job is not None]
+            if batch:
+                self._commit(connection, batch)
+        connection.close()
+
+    def _commit(self, connection: sqlite3.Connection, batch: list[WriteJob]) -> None:
+        done: list[tuple[WriteJob, Any]] = []
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                write, _, future = job
+                connection.execute("SAVEPOINT write")
+                try:
+                    result = write(connection)
+                except Exception as e:
+                    connection.execute("ROLLBACK TO write")
+                    future.set_exception(e)
+                else:
+                    done.append((job, result))
+                finally:
+                    connection.execute("RELEASE write")
+            connection.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Error committing a batch of {len(batch)} writes: {e}")
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(done)
+        for (_, on_commit, future), result in done:
+            try:
+                if on_commit is not None:
+                    on_commit(result)
+            except Exception as e:
+                logger.exception(f"Error applying a committed write: {e}")
+            future.set_result(result)
+
+
+class _ReadPool:
+    """
+    A few connections for reads, which WAL lets run alongside the writer.
+    """
+
+    def __init__(self, size: int = SQLITE_READ_CONNECTIONS) -> None:
+        self._connections: queue.Queue[sqlite3.Connection] = queue.Queue()
+        self._all: list[sqlite3.Connection] = []
+        for _ in range(size):
+            connection = _connect()
+            self._all.append(connection)
+            self._connections.put(connection)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self) -> None:
+        for connection in self._all:
+            connection.close()
+        self._all.clear()
+
+
+_writer: _Writer | None = None
+_read_pool: _ReadPool | None = None
+_open_lock = threading.Lock()
+
+
+def _open() -> tuple[_Writer, _ReadPool]:
+    global _writer, _read_pool
+    with _open_lock:
+        if _writer is None:
+            # The writer creates the tables, so it has to be up before anything reads
+            _writer = _Writer()
+            _read_pool = _ReadPool()
+    return _writer, _read_pool
+
+
+def _write(
+    write: Callable[[sqlite3.Connection], Any],
+    on_commit: Callable[[Any], None] | None = None,
+) -> Any:
+    """Run a write on the writer thread, waiting for it to be committed."""
+    return _open()[0].submit(write, on_commit).result()
+
+
+async def _write_async(
+    write: Callable[[sqlite3.Connection], Any],
+    on_commit: Callable[[Any], None] | None = None,
+) -> Any:
+    """Run a write on the writer thread, without blocking the event loop while it's committed."""
+    return await asyncio.wrap_future(_open()[0].submit(write, on_commit))
+
+
+def _read(query: str, parameters: tuple = ()) -> list[tuple]:
+    with _open()[1].connection() as connection:
+        return connection.execute(query, parameters).fetchall()
+
+
+class _Snapshot:
+    """
+    In-memory copy of the subscriptions and admins tables.
+    Writes go to SQLite first and are then applied here under a lock, so reads never touch the database.
+    Writes are applied on the writer thread, so they replace the mappings with changed copies rather than
+    changing them in place, and a mapping handed out is never modified while a reader iterates it.
+    """
+
+    def __init__(self) -> None:
+        self.subscriptions: dict[int, frozenset[str]] = {}
+        # Subscriptions made to a known location, matched exactly by its ID
+        self.location_ids: dict[tuple[int, str], int] = {}
+        self.admins: frozenset[int] = frozenset()
+        self.version = 0
+        self.changes: deque[tuple[int, str, int, str, int | None]] = deque(
+            maxlen=SUBSCRIPTION_CHANGES_KEPT
+        )
+        self.loaded = False
+        self.lock = threading.Lock()
+
+
+_snapshot = _Snapshot()
+
+
+def _init_tables(connection: sqlite3.Connection) -> None:
     """Initialize database tables if they don't exist."""
     try:
-        cursor = get_db().cursor()
+        cursor = connection.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS subscriptions (
                 user_id INTEGER,
@@ -37,107 +266,339 @@ def _init_tables() -> None:
                 PRIMARY KEY (user_id)
             )
         """)
-        get_db().commit()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS locations (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE
+            )
+        """)
+        # Snapshots of in-memory state, each replaced as a whole
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS state (
+                name TEXT PRIMARY KEY,
+                saved_at REAL,
+                data BLOB
+            )
+        """)
+        # Append only, one row per location of an alert
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS alert_events (
+                alert_id TEXT,
+                category INTEGER,
+                title TEXT,
+                location TEXT,
+                raised_at REAL,
+                PRIMARY KEY (alert_id, location)
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS alert_events_location ON alert_events (location, raised_at)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS alert_events_raised_at ON alert_events (raised_at)"
+        )
+        # Subscriptions to a known location also store its ID
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(subscriptions)")}
+        if "location_id" not in columns:
+            cursor.execute("ALTER TABLE subscriptions ADD COLUMN location_id INTEGER")
     except Exception as e:
         logger.error(f"Error initializing database tables: {e}")
         raise
 
 
-def add_subscription(user_id: int, location: str) -> bool:
-    """Add a new subscription for a user."""
-    try:
-        cursor = get_db().cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO subscriptions (user_id, location) VALUES (?, ?)",
-            (user_id, location.lower()),
+def load_snapshot() -> None:
+    """Load the subscriptions and admins tables into memory."""
+    with _open()[1].connection() as connection:
+        subscriptions: dict[int, set[str]] = {}
+        location_ids: dict[tuple[int, str], int] = {}
+        for user_id, location, location_id in connection.execute(SELECT_SUBSCRIPTIONS):
+            subscriptions.setdefault(user_id, set()).add(location)
+            if location_id is not None:
+                location_ids[(user_id, location)] = location_id
+        admins = frozenset(row[0] for row in connection.execute(SELECT_ADMINS))
+
+    with _snapshot.lock:
+        _snapshot.subscriptions = {
+            user_id: frozenset(locations)
+            for user_id, locations in subscriptions.items()
+        }
+        _snapshot.location_ids = location_ids
+        _snapshot.admins = admins
+        _snapshot.version += 1
+        # Anything derived from older versions has to be rebuilt from scratch
+        _snapshot.changes.clear()
+        _snapshot.loaded = True
+    logger.info(
+        f"Loaded {sum(map(len, subscriptions.values()))} subscriptions of {len(subscriptions)} users and {len(admins)} admins"
+    )
+
+
+def _get_snapshot() -> _Snapshot:
+    if not _snapshot.loaded:
+        load_snapshot()
+    return _snapshot
+
+
+def _apply_subscription_change(
+    operation: str, user_id: int, location: str, location_id: int | None = None
+) -> None:
+    snapshot = _get_snapshot()
+    with snapshot.lock:
+        subscriptions = dict(snapshot.subscriptions)
+        locations = subscriptions.get(user_id, frozenset())
+        if operation == "add":
+            locations = locations | {location}
+            if location_id is not None:
+                location_ids = dict(snapshot.location_ids)
+                location_ids[(user_id, location)] = location_id
+                snapshot.location_ids = location_ids
+        else:
+            locations = locations - {location}
+            location_id = snapshot.location_ids.get((user_id, location))
+            if location_id is not None:
+                location_ids = dict(snapshot.location_ids)
+                del location_ids[(user_id, location)]
+                snapshot.location_ids = location_ids
+        if locations:
+            subscriptions[user_id] = locations
+        else:
+            subscriptions.pop(user_id, None)
+        snapshot.subscriptions = subscriptions
+        snapshot.version += 1
+        snapshot.changes.append(
+            (snapshot.version, operation, user_id, location, location_id)
+        )
+
+
+def get_subscriptions_version() -> int:
+    """Get the version of the subscriptions snapshot, which changes on every write."""
+    return _get_snapshot().version
+
+
+def get_subscription_changes(
+    since_version: int,
+) -> list[tuple[str, int, str, int | None]] | None:
+    """
+    Get the (operation, user_id, location, location_id) changes made after the given version.
+    Returns None if some of them are no longer kept, in which case readers should rebuild.
+    """
+    snapshot = _get_snapshot()
+    with snapshot.lock:
+        if since_version == snapshot.version:
+            return []
+        if not snapshot.changes or snapshot.changes[0][0] > since_version + 1:
+            return None
+        return [
+            (operation, user_id, location, location_id)
+            for version, operation, user_id, location, location_id in snapshot.changes
+            if version > since_version
+        ]
+
+
+async def add_subscription(
+    user_id: int, location: str, location_id: int | None = None
+) -> bool:
+    """Add a new subscription for a user, by ID if it's a known location."""
+    location = location.lower()
+
+    def insert(connection: sqlite3.Connection) -> bool:
+        cursor = connection.execute(
+            INSERT_SUBSCRIPTION, (user_id, location, location_id)
         )
-        get_db().commit()
         return cursor.rowcount > 0
+
+    def on_commit(added: bool) -> None:
+        if added:
+            _apply_subscription_change("add", user_id, location, location_id)
+
+    try:
+        return await _write_async(insert, on_commit)
     except Exception as e:
         logger.error(f"Error adding subscription: {e}")
         return False
 
 
-def remove_subscription(user_id: int, location: str) -> bool:
+async def remove_subscription(user_id: int, location: str) -> bool:
     """Remove a subscription for a user."""
-    try:
-        cursor = get_db().cursor()
-        cursor.execute(
-            "DELETE FROM subscriptions WHERE user_id = ? AND location = ?",
-            (user_id, location.lower()),
-        )
-        get_db().commit()
+    location = location.lower()
+
+    def delete(connection: sqlite3.Connection) -> bool:
+        cursor = connection.execute(DELETE_SUBSCRIPTION, (user_id, location))
         return cursor.rowcount > 0
+
+    def on_commit(removed: bool) -> None:
+        if removed:
+            _apply_subscription_change("remove", user_id, location)
+
+    try:
+        return await _write_async(delete, on_commit)
     except Exception as e:
         logger.error(f"Error removing subscription: {e}")
         return False
 
 
+def add_subscriptions(rows: list[tuple[int, str]]) -> None:
+    """Import many (user_id, location) subscriptions in a single transaction, reloading the snapshot."""
+    _write(
+        lambda connection: connection.executemany(
+            INSERT_SUBSCRIPTION,
+            [(user_id, location.lower(), None) for user_id, location in rows],
+        ),
+        lambda _: load_snapshot(),
+    )
+
+
 def get_user_subscriptions(user_id: int) -> Set[str]:
     """Get all subscriptions for a user."""
-    try:
-        cursor = get_db().cursor()
-        cursor.execute(
-            "SELECT location FROM subscriptions WHERE user_id = ?", (user_id,)
-        )
-        return {row[0] for row in cursor.fetchall()}
-    except Exception as e:
-        logger.error(f"Error getting user subscriptions: {e}")
-        return set()
+    return set(_get_snapshot().subscriptions.get(user_id, ()))
 
 
-def get_all_subscriptions() -> Dict[int, Set[str]]:
-    """Get all subscriptions for all users."""
-    try:
-        cursor = get_db().cursor()
-        cursor.execute("SELECT user_id, location FROM subscriptions")
-        subscriptions = {}
-        for user_id, location in cursor.fetchall():
-            if user_id not in subscriptions:
-                subscriptions[user_id] = set()
-            subscriptions[user_id].add(location)
-        return subscriptions
-    except Exception as e:
-        logger.error(f"Error getting all subscriptions: {e}")
-        return {}
+def get_all_subscriptions() -> Dict[int, frozenset[str]]:
+    """
+    Get all subscriptions for all users. The returned mapping is shared and must not be modified,
+    writes replace it rather than change it.
+    """
+    return _get_snapshot().subscriptions
+
+
+def get_subscription_location_ids() -> Dict[tuple[int, str], int]:
+    """
+    Get the location IDs of the (user_id, location) subscriptions made to a known location.
+    The returned mapping is shared and must not be modified, writes replace it rather than change it.
+    """
+    return _get_snapshot().location_ids
 
 
 def get_all_users() -> Set[int]:
     """Get all users."""
-    try:
-        cursor = get_db().cursor()
-        cursor.execute("SELECT user_id FROM subscriptions")
-        return {row[0] for row in cursor.fetchall()}
-    except Exception as e:
-        logger.error(f"Error getting all users: {e}")
-        return set()
+    return set(_get_snapshot().subscriptions)
 
 
 def add_admin(user_id: int) -> bool:
     """Add admin user"""
+
+    def on_commit(_) -> None:
+        snapshot = _get_snapshot()
+        with snapshot.lock:
+            snapshot.admins = snapshot.admins | {user_id}
+
     try:
-        cursor = get_db().cursor()
-        cursor.execute(f"INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
+        _write(
+            lambda connection: connection.execute(INSERT_ADMIN, (user_id,)), on_commit
+        )
         return True
     except Exception as e:
         logger.error(f"Error adding admin: {e}")
         return False
 
 
-def get_admins() -> Set[int]:
+def get_admins() -> frozenset[int]:
     """Get all admins"""
+    return _get_snapshot().admins
+
+
+def get_locations() -> list[tuple[int, str]]:
+    """Get all known locations and their IDs."""
+    return _read(SELECT_LOCATIONS)
+
+
+def add_locations(names: list[str]) -> list[tuple[int, str]]:
+    """
+    Add locations which aren't known yet, returning the IDs and names of all the given ones,
+    since another process sharing the database may have added them already.
+    """
+
+    def insert(connection: sqlite3.Connection) -> list[tuple[int, str]]:
+        connection.executemany(INSERT_LOCATION, [(name,) for name in names])
+        return [
+            connection.execute(SELECT_LOCATION, (name,)).fetchone() for name in names
+        ]
+
     try:
-        cursor = get_db().cursor()
-        cursor.execute("SELECT user_id FROM admins")
-        return {row[0] for row in cursor.fetchall()}
+        return _write(insert)
     except Exception as e:
-        logger.error(f"Error getting admins: {e}")
-        return set()
+        logger.error(f"Error adding locations: {e}")
+        return []
+
+
+# An (alert_id, category, title, location, raised_at) row, raised_at being a Unix time
+AlertEvent = tuple[str, int, str, str, float]
+
+
+async def add_alert_events(rows: list[AlertEvent]) -> int:
+    """Record alert events seen on the live feed, ignoring ones already recorded. Returns how many were new."""
+
+    def insert(connection: sqlite3.Connection) -> int:
+        return connection.executemany(INSERT_ALERT_EVENT, rows).rowcount
+
+    return await _write_async(insert)
+
+
+async def add_history_events(rows: list[AlertEvent], tolerance: float) -> int:
+    """
+    Record alert events from the alert history, skipping ones recorded within `tolerance` seconds
+    for the same title and location. Returns how many were new.
+    """
+
+    def insert(connection: sqlite3.Connection) -> int:
+        return connection.executemany(
+            INSERT_HISTORY_EVENT,
+            [
+                (
+                    alert_id,
+                    category,
+                    title,
+                    location,
+                    raised_at,
+                    location,
+                    raised_at - tolerance,
+                    raised_at + tolerance,
+                    title,
+                )
+                for alert_id, category, title, location, raised_at in rows
+            ],
+        ).rowcount
+
+    return await _write_async(insert)
+
+
+def get_alert_events(
+    since: float, until: float = float("inf"), location: str | None = None
+) -> list[AlertEvent]:
+    """Get the alert events raised in [since, until), of a single location if given, oldest first."""
+    if location is None:
+        return _read(SELECT_ALERT_EVENTS, (since, until))
+    return _read(SELECT_LOCATION_ALERT_EVENTS, (location, since, until))
+
+
+def get_alert_events_after(
+    rowid: int,
+) -> list[tuple[int, str, int | None, str, str, float]]:
+    """
+    Get the (rowid, alert_id, category, title, location, raised_at) of the alert events stored after the given row,
+    in the order they were stored, so readers can follow the store incrementally.
+    """
+    return _read(SELECT_ALERT_EVENTS_AFTER, (rowid,))
+
+
+async def save_state(name: str, saved_at: float, data: bytes) -> None:
+    """Replace the saved snapshot of the given name."""
+    await _write_async(
+        lambda connection: connection.execute(UPSERT_STATE, (name, saved_at, data))
+    )
+
+
+def load_state(name: str) -> tuple[float, bytes] | None:
+    """Get the Unix time the snapshot of the given name was saved at and its data, if there is one."""
+    rows = _read(SELECT_STATE, (name,))
+    return rows[0] if rows else None
 
 
 def close_db() -> None:
-    """Close the database connections."""
-    for connection in connections.values():
-        if connection:
-            connection.close()
-    connections.clear()
+    """Commit the queued writes and close the database connections."""
+    global _writer, _read_pool
+    with _open_lock:
+        if _writer is not None:
+            _writer.close()
+            _read_pool.close()
+            _writer = _read_pool = None
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+from typing import Sequence
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import (
+    DISPATCH_GLOBAL_RATE,
+    DISPATCH_MAX_RETRIES,
+    DISPATCH_PER_CHAT_RATE,
+    DISPATCH_WORKERS,
+)
+from metrics import dispatch_seconds, messages_sent, send_failures
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_DELAY = 0.5
+IDLE_CHAT_BUCKET_SECONDS = 60
+
+
+class TokenBucket:
+    """
+    Allows up to `rate` acquisitions per second, with bursts of up to `capacity`
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def last_used(self) -> float:
+        return self._updated
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for the given duration, e.g. after a flood wait."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class DispatchStats:
+    """
+    Delivery statistics of a single batch
+    """
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies: list[float] = []
+
+    def record_success(self, latency: float) -> None:
+        self.sent += 1
+        self.latencies.append(latency)
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def __str__(self):
+        return (
+            f"DispatchStats(sent={self.sent}, failed={self.failed}, retries={self.retries}, "
+            f"p50={self.percentile(50) * 1000:.0f}ms, p99={self.percentile(99) * 1000:.0f}ms)"
+        )
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+
+class Dispatcher:
+    """
+    Sends batches of messages through a bounded pool of workers,
+    respecting Telegram's global and per-chat rate limits
+    """
+
+    def __init__(
+        self,
+        workers: int = DISPATCH_WORKERS,
+        global_rate: float = DISPATCH_GLOBAL_RATE,
+        per_chat_rate: float = DISPATCH_PER_CHAT_RATE,
+        max_retries: int = DISPATCH_MAX_RETRIES,
+    ) -> None:
+        self._workers = workers
+        self._per_chat_rate = per_chat_rate
+        self._max_retries = max_retries
+        # No burst allowance, so no second sends more than global_rate messages, including the first one
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._batches: set[asyncio.Task] = set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._per_chat_rate, capacity=3)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        cutoff = time.monotonic() - IDLE_CHAT_BUCKET_SECONDS
+        for chat_id in [
+            chat_id
+            for chat_id, bucket in self._chat_buckets.items()
+            if bucket.last_used < cutoff
+        ]:
+            del self._chat_buckets[chat_id]
+
+    async def send_batch(
+        self, bot: Bot, payloads: list[tuple[Sequence[str], list[int]]]
+    ) -> DispatchStats:
+        """
+        Send the messages of every (messages, chat_ids) payload to each of its chats, in order,
+        returning the batch delivery stats per chat.
+        """
+        stats = DispatchStats()
+        chats = sum(len(chat_ids) for _, chat_ids in payloads)
+        if not chats:
+            return stats
+        messages = sum(len(texts) * len(chat_ids) for texts, chat_ids in payloads)
+        self._prune_chat_buckets()
+        queue: asyncio.Queue[tuple[int, Sequence[str]]] = asyncio.Queue()
+        for texts, chat_ids in payloads:
+            for chat_id in chat_ids:
+                queue.put_nowait((chat_id, texts))
+        started = time.monotonic()
+        with dispatch_seconds.time():
+            await asyncio.gather(
+                *(
+                    self._worker(bot, queue, stats, started)
+                    for _ in range(min(self._workers, chats))
+                )
+            )
+        logger.info(
+            f"Dispatched batch of {messages} messages to {chats} chats with {len(payloads)} distinct payloads, "
+            f"up to {max(len(chat_ids) for _, chat_ids in payloads)} recipients per payload: {stats}"
+        )
+        return stats
+
+    def submit_batch(
+        self, bot: Bot, payloads: list[tuple[Sequence[str], list[int]]]
+    ) -> asyncio.Task[DispatchStats]:
+        """Send a batch in the background, so the caller can move on. drain() waits for it."""
+        task = asyncio.create_task(self.send_batch(bot, payloads))
+        self._batches.add(task)
+        task.add_done_callback(self._batch_done)
+        return task
+
+    def _batch_done(self, task: asyncio.Task) -> None:
+        self._batches.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logger.error(
+                f"Error sending a batch: {type(error).__name__}: {error}",
+                exc_info=error,
+            )
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """Wait for the batches being sent to finish, returning whether they did within the timeout."""
+        if not self._batches:
+            return True
+        logger.info(f"Waiting for {len(self._batches)} batches to finish sending")
+        _, pending = await asyncio.wait(set(self._batches), timeout=timeout)
+        if pending:
+            logger.warning(
+                f"{len(pending)} batches were still sending after {timeout}s"
+            )
+            return False
+        return True
+
+    async def _worker(
+        self,
+        bot: Bot,
+        queue: asyncio.Queue[tuple[int, Sequence[str]]],
+        stats: DispatchStats,
+        started: float,
+    ) -> None:
+        while not queue.empty():
+            chat_id, texts = queue.get_nowait()
+            for text in texts:
+                # The rest of the messages would make no sense without the ones before them
+                if not await self._send(bot, chat_id, text, stats):
+                    stats.failed += 1
+                    break
+            else:
+                stats.record_success(time.monotonic() - started)
+
+    async def _send(
+        self, bot: Bot, chat_id: int, text: str, stats: DispatchStats
+    ) -> bool:
+        """Send a message, retrying when rate limited or on network errors. Returns whether it was sent."""
+        for attempt in range(self._max_retries + 1):
+            # The chat's turn first, so no global token is held while waiting on a single chat
+            await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                messages_sent.inc()
+                return True
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logger.warning(f"Flood wait of {delay}s while sending to {chat_id}")
+                self._global_bucket.pause(delay)
+                error = e
+            except (Forbidden, BadRequest) as e:
+                logger.error(f"Failed to send message to user {chat_id}: {e}")
+                break
+            except NetworkError as e:
+                error = e
+                await asyncio.sleep(
+                    RETRY_BASE_DELAY * 2**attempt * random.uniform(0.5, 1.5)
+                )
+            except Exception as e:
+                logger.error(f"Failed to send message to user {chat_id}: {e}")
+                break
+            if attempt < self._max_retries:
+                stats.retries += 1
+            else:
+                logger.error(
+                    f"Failed to send message to user {chat_id} after {attempt + 1} attempts: {error}"
+                )
+        send_failures.inc()
+        return False
+
+
+dispatcher = Dispatcher()
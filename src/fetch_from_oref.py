@@ -1,14 +1,153 @@
+import asyncio
+import codecs
+import hashlib
 import json
-from typing import Any
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator
 
 import aiohttp
 
-from alert_data import EMPTY_RESPONSE_TEXT
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+from config import (
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_POOL_SIZE,
+    OREF_BASE_URL,
+    OREF_HEDGE_DEFAULT_DELAY,
+    OREF_HEDGE_MIN_DELAY,
+    OREF_MIRRORS,
+)
+from metrics import (
+    empty_responses,
+    fetch_seconds,
+    hedged_requests,
+    not_modified_responses,
+    parse_errors,
+    parse_seconds,
+    unchanged_bodies,
+)
+
+logger = logging.getLogger(__name__)
+
+_session: aiohttp.ClientSession | None = None
+"""
+One pooled session for the lifetime of the bot, so polls reuse the same keep-alive TLS connection.
+"""
+_validators: dict[str, dict[str, str]] = {}
+_last_parsed: dict[str, Any] = {}
+_body_hashes: dict[str, bytes] = {}
+
+ROWS_CHUNK_SIZE = 16 * 1024
+_JSON_SEPARATORS = " \t\r\n,"
+_JSON_START = re.compile(rb"[{\[]")
+REQUEST_TIMEOUT = 10
+ENDPOINT_LATENCIES_KEPT = 200
+# Below this many samples an endpoint's p95 isn't trusted, and the default hedge delay is used
+HEDGE_MIN_SAMPLES = 20
+
+
+class FetchStats:
+    """
+    Running latency counters for requests sent to OREF
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float, not_modified: bool = False, error: bool = False):
+        self.requests += 1
+        self.not_modified += not_modified
+        self.errors += error
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (
+            f"FetchStats(requests={self.requests}, not_modified={self.not_modified}, errors={self.errors}, "
+            f"avg={self.average_time * 1000:.1f}ms, max={self.max_time * 1000:.1f}ms)"
+        )
+
+
+fetch_stats = FetchStats()
+
+
+class Endpoint:
+    """
+    An OREF host serving the alert files, with its recent latencies and errors.
+    A request to it is hedged with the next endpoint once it takes longer than its recent p95,
+    or right away while it keeps failing.
+    """
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.latencies: deque[float] = deque(maxlen=ENDPOINT_LATENCIES_KEPT)
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.cancelled = 0
+        self.wins = 0
+
+    def record(self, elapsed: float, error: bool = False) -> None:
+        self.requests += 1
+        if error:
+            self.errors += 1
+            self.consecutive_errors += 1
+        else:
+            self.consecutive_errors = 0
+            self.latencies.append(elapsed)
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    @property
+    def hedge_delay(self) -> float:
+        if self.consecutive_errors:
+            return 0.0
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return OREF_HEDGE_DEFAULT_DELAY
+        return max(OREF_HEDGE_MIN_DELAY, self.percentile(95))
+
+    def __str__(self):
+        return (
+            f"Endpoint({self.base_url}, requests={self.requests}, errors={self.errors}, wins={self.wins}, "
+            f"cancelled={self.cancelled}, p50={self.percentile(50) * 1000:.1f}ms, p95={self.percentile(95) * 1000:.1f}ms)"
+        )
+
+
+endpoints = [Endpoint(OREF_BASE_URL)] + [Endpoint(url) for url in OREF_MIRRORS]
+
+
+def _ordered_endpoints() -> list[Endpoint]:
+    """The configured endpoints in order, with failing ones moved last."""
+    return sorted(endpoints, key=lambda endpoint: endpoint.consecutive_errors > 0)
 
 
 def create_session() -> aiohttp.ClientSession:
-    """Create and configure a requests session."""
-    session = aiohttp.ClientSession()
+    """Create and configure a pooled keep-alive session."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    session = aiohttp.ClientSession(connector=connector)
     session.headers.update(
         {
             "User-Agent": "Mozilla/5.0 (compatible; Python requests)",
@@ -20,39 +159,235 @@ def create_session() -> aiohttp.ClientSession:
     return session
 
 
-async def fetch_data_from_oref(
-    save_data: bool, file_to_fetch: str
-) -> dict[str, Any] | list[dict[str, Any]] | None:
-    try:
-        async with create_session() as session:
-            async with session.get(
-                f"https://www.oref.org.il/WarningMessages/alert/{file_to_fetch}",
-                timeout=10,
+def get_session() -> aiohttp.ClientSession:
+    """Get the shared session, creating it if it doesn't exist yet."""
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+    return _session
+
+
+async def start_session() -> None:
+    """Open the shared session and warm it up, visiting the homepage to get cookies."""
+    for endpoint in endpoints:
+        started = time.perf_counter()
+        try:
+            async with get_session().get(
+                f"{endpoint.base_url}/", timeout=REQUEST_TIMEOUT
             ) as response:
-                response.raise_for_status()
-
-                text = (await response.text()).strip().replace("\0", "")
-                if text == EMPTY_RESPONSE_TEXT or len(text) == 0:
-                    return None
-                if "{" not in text and "[" not in text:
-                    return None
-                if text[0] != "{" or text[0] != "[":
-                    object_start = float("inf")
-                    list_start = float("inf")
-                    if "{" in text:
-                        object_start = text.index("{")
-                    if "[" in text:
-                        list_start = text.index("[")
-                    if list_start < object_start:
-                        text = text[list_start:].encode("utf-8").decode("utf-8-sig")
-                    else:
-                        text = text[object_start:].encode("utf-8").decode("utf-8-sig")
-
-                return json.loads(text)
+                await response.read()
+            logger.info(
+                f"OREF session to {endpoint.base_url} warmed up in {(time.perf_counter() - started) * 1000:.1f}ms"
+            )
+        except Exception as e:
+            logger.warning(
+                f"Failed to warm up OREF session to {endpoint.base_url}: {type(e).__name__}: {e}"
+            )
+
+
+async def close_session() -> None:
+    """Close the shared session."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def is_feed_empty(file_to_fetch: str) -> bool:
+    """Whether the last fetched version of the file was empty."""
+    return _last_parsed.get(file_to_fetch) is None
+
+
+def _parse_body(body: bytes) -> dict[str, Any] | list[dict[str, Any]] | None:
+    """
+    Parse a raw OREF body, which may be padded with a BOM, NULs and whitespace, or be empty.
+    Works on the bytes, so the body is only copied when it has NULs or doesn't start with the JSON.
+    """
+    if b"\0" in body:
+        body = body.replace(b"\0", b"")
+    match = _JSON_START.search(body)
+    if match is None:
+        return None
+    return _loads(body[match.start() :] if match.start() else body)
+
+
+def _body_hash(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+async def _get_body(endpoint: Endpoint, file_to_fetch: str) -> bytes | None:
+    """Conditionally GET a file from one endpoint, returning None if it's unchanged."""
+    started = time.perf_counter()
+    validators_key = f"{endpoint.base_url}/{file_to_fetch}"
+    try:
+        async with get_session().get(
+            f"{endpoint.base_url}/WarningMessages/alert/{file_to_fetch}",
+            headers=_validators.get(validators_key),
+            timeout=REQUEST_TIMEOUT,
+        ) as response:
+            if response.status == 304:
+                endpoint.record(time.perf_counter() - started)
+                return None
+            response.raise_for_status()
+
+            validators = {}
+            if etag := response.headers.get("ETag"):
+                validators["If-None-Match"] = etag
+            if last_modified := response.headers.get("Last-Modified"):
+                validators["If-Modified-Since"] = last_modified
+            _validators[validators_key] = validators
+
+            body = await response.read()
+            endpoint.record(time.perf_counter() - started)
+            return body
+    except asyncio.CancelledError:
+        endpoint.cancelled += 1
+        raise
     except Exception as e:
+        endpoint.record(time.perf_counter() - started, error=True)
+        _validators.pop(validators_key, None)
         e.add_note(
             await response.text()
             if "response" in locals()
             else "<no response from server>"
         )
         raise
+
+
+async def _hedged_get_body(file_to_fetch: str) -> bytes | None:
+    """
+    Get a file from the first endpoint, sending the same request to the next one whenever the
+    requests in flight take longer than the hedge delay or fail, and returning the first response.
+    The requests which lost the race are cancelled.
+    """
+    remaining = _ordered_endpoints()
+    in_flight: dict[asyncio.Task, Endpoint] = {}
+    error: Exception | None = None
+    try:
+        while True:
+            if remaining and (not in_flight or error is not None):
+                endpoint = remaining.pop(0)
+                if in_flight:
+                    hedged_requests.inc()
+                in_flight[asyncio.create_task(_get_body(endpoint, file_to_fetch))] = (
+                    endpoint
+                )
+                error = None
+            if not in_flight:
+                raise error
+            hedge_delay = (
+                min(endpoint.hedge_delay for endpoint in in_flight.values())
+                if remaining
+                else None
+            )
+            done, _ = await asyncio.wait(
+                in_flight, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                # Too slow, hedge with the next endpoint
+                error = TimeoutError(f"No response within {hedge_delay:.3f}s")
+                continue
+            for task in done:
+                endpoint = in_flight.pop(task)
+                if task.exception() is None:
+                    endpoint.wins += 1
+                    return task.result()
+                error = task.exception()
+                logger.warning(
+                    f"Fetching {file_to_fetch} from {endpoint.base_url} failed: {type(error).__name__}: {error}"
+                )
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+async def fetch_data_from_oref(
+    save_data: bool, file_to_fetch: str, skip_unchanged: bool = False
+) -> dict[str, Any] | list[dict[str, Any]] | None:
+    """
+    Fetches and parses a file from OREF using conditional GETs, hedged across the configured endpoints.
+    When the server reports the file as unchanged, or returns the same body as last time,
+    the previously parsed data is returned, or None if skip_unchanged is set.
+    """
+    started = time.perf_counter()
+    not_modified = False
+    error = False
+    try:
+        body = await _hedged_get_body(file_to_fetch)
+        fetch_seconds.observe(time.perf_counter() - started)
+        if body is None:
+            not_modified = True
+            not_modified_responses.inc()
+            return None if skip_unchanged else _last_parsed.get(file_to_fetch)
+
+        with parse_seconds.time():
+            body_hash = _body_hash(body)
+            if body_hash == _body_hashes.get(file_to_fetch):
+                not_modified = True
+                unchanged_bodies.inc()
+                return None if skip_unchanged else _last_parsed.get(file_to_fetch)
+            try:
+                data = _parse_body(body)
+            except json.JSONDecodeError as e:
+                parse_errors.inc()
+                e.add_note(body.decode("utf-8", "replace"))
+                raise
+        if data is None:
+            empty_responses.inc()
+        _last_parsed[file_to_fetch] = data
+        _body_hashes[file_to_fetch] = body_hash
+        return data
+    except Exception:
+        error = True
+        raise
+    finally:
+        fetch_stats.record(time.perf_counter() - started, not_modified, error)
+
+
+async def iter_rows_from_oref(file_to_fetch: str) -> AsyncIterator[dict[str, Any]]:
+    """
+    Fetches a JSON list from OREF and yields its rows while the body is still being received.
+    Breaking out of the iteration stops downloading the rest of the body.
+    """
+    started = time.perf_counter()
+    error = False
+    try:
+        async with get_session().get(
+            f"{_ordered_endpoints()[0].base_url}/WarningMessages/alert/{file_to_fetch}",
+            timeout=REQUEST_TIMEOUT,
+        ) as response:
+            response.raise_for_status()
+            text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+            json_decoder = json.JSONDecoder()
+            buffer = ""
+            in_list = False
+            async for chunk in response.content.iter_chunked(ROWS_CHUNK_SIZE):
+                buffer += text_decoder.decode(chunk).replace("\0", "")
+                position = 0
+                if not in_list:
+                    list_start = buffer.find("[")
+                    if list_start == -1:
+                        continue
+                    in_list = True
+                    position = list_start + 1
+                while True:
+                    while (
+                        position < len(buffer) and buffer[position] in _JSON_SEPARATORS
+                    ):
+                        position += 1
+                    if position < len(buffer) and buffer[position] == "]":
+                        return
+                    try:
+                        row, position = json_decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError:
+                        # The row is cut off at the end of this chunk
+                        break
+                    yield row
+                buffer = buffer[position:]
+    except Exception:
+        error = True
+        raise
+    finally:
+        fetch_stats.record(time.perf_counter() - started, error=error)
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from typing import ItemsView
+
+from database import (
+    add_locations,
+    get_locations,
+)
+
+logger = logging.getLogger(__name__)
+
+SEED_FILE = Path(__file__).parent / "data" / "locations.json"
+
+# Points and cantillation marks, leaving out the punctuation among them, like the maqaf which separates words
+_NIQQUD = re.compile("[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]")
+_QUOTES = re.compile("[\"'`׳״‘’“”]")
+_SEPARATORS = re.compile("[-־‐-―,.()\\s]+")
+
+
+def normalize(name: str) -> str:
+    """Normalize a location name for comparison, ignoring niqqud, quotes, hyphens and spacing."""
+    name = _NIQQUD.sub("", name.lower())
+    name = _QUOTES.sub("", name)
+    return _SEPARATORS.sub(" ", name).strip()
+
+
+def trigrams(normalized: str) -> set[str]:
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    All known alert locations, each with a compact integer ID which is persisted in the database.
+    Keeps a trigram index over the normalized names for fuzzy suggestions.
+    """
+
+    def __init__(self) -> None:
+        self._names: dict[int, str] = {}
+        self._ids: dict[str, int] = {}
+        self._normalized_ids: dict[str, int] = {}
+        self._trigrams: dict[str, set[int]] = {}
+        self._trigram_counts: dict[int, int] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def load(self) -> None:
+        """Load the known locations, adding the seed locations shipped with the bot."""
+        with open(SEED_FILE, "r", encoding="utf-8") as f:
+            add_locations(json.load(f))
+        for location_id, name in get_locations():
+            self._index(location_id, name)
+        self.version += 1
+        logger.info(f"Gazetteer loaded with {len(self._names)} locations")
+
+    def _index(self, location_id: int, name: str) -> None:
+        normalized = normalize(name)
+        self._names[location_id] = name
+        self._ids[name] = location_id
+        self._normalized_ids.setdefault(normalized, location_id)
+        name_trigrams = trigrams(normalized)
+        self._trigram_counts[location_id] = len(name_trigrams)
+        for trigram in name_trigrams:
+            self._trigrams.setdefault(trigram, set()).add(location_id)
+
+    async def learn(self, names: list[str]) -> None:
+        """Add locations seen in alerts which aren't known yet."""
+        unknown = [name for name in names if name not in self._ids]
+        if not unknown:
+            return
+        for location_id, name in await asyncio.to_thread(add_locations, unknown):
+            self._index(location_id, name)
+            logger.info(f"Learned new location: {name}")
+        self.version += 1
+
+    def get_id(self, name: str) -> int | None:
+        """Get the ID of a location exactly as it appears in alerts."""
+        return self._ids.get(name)
+
+    def get_name(self, location_id: int) -> str:
+        return self._names[location_id]
+
+    def items(self) -> ItemsView[int, str]:
+        return self._names.items()
+
+    def resolve(self, text: str) -> int | None:
+        """Get the ID of the location the user typed, ignoring spelling differences in punctuation."""
+        return self._normalized_ids.get(normalize(text))
+
+    def is_part_of_known(self, text: str) -> bool:
+        """Whether the text is part of any known location name."""
+        normalized = normalize(text)
+        if not normalized:
+            return False
+        if len(normalized) < 3:
+            candidates = self._names.keys()
+        else:
+            postings = sorted(
+                (
+                    self._trigrams.get(trigram, set())
+                    for trigram in trigrams(normalized)
+                    if not trigram.startswith(" ") and not trigram.endswith(" ")
+                ),
+                key=len,
+            )
+            candidates = set.intersection(*postings) if postings else set()
+        return any(
+            normalized in normalize(self._names[location_id])
+            for location_id in candidates
+        )
+
+    def suggest(self, text: str, limit: int = 5) -> list[str]:
+        """Get the known locations most similar to the text, by trigram similarity."""
+        normalized = normalize(text)
+        if not normalized:
+            return []
+        query_trigrams = trigrams(normalized)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        scored = sorted(
+            (
+                count
+                / (len(query_trigrams) + self._trigram_counts[location_id] - count),
+                location_id,
+            )
+            for location_id, count in shared.items()
+        )
+        return [self._names[location_id] for _, location_id in scored[::-1][:limit]]
+
+
+gazetteer = Gazetteer()
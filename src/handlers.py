@@ -1,14 +1,15 @@
-import datetime
 import functools
 import logging
+import time
 from collections import defaultdict
-from datetime import timedelta
-from telegram import Update
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
 from telegram.ext import (
     ContextTypes,
 )
 
-from alert_monitor import get_alert_history
+from alert_stats import alert_stats
+from alert_store import alert_store
+from config import ACTIVE_ALERTS_WINDOW
 from database import (
     add_subscription,
     get_admins,
@@ -17,6 +18,11 @@ from database import (
     remove_subscription,
     get_user_subscriptions,
 )
+from dispatcher import dispatcher
+from message_packer import pack_sections, pack_text
+from gazetteer import gazetteer
+from regions import REGION_PREFIX, regions
+from subscription_matcher import ALL_KEYWORD, subscription_matcher
 
 logger = logging.getLogger(__name__)
 print = logger.info
@@ -36,6 +42,12 @@ def admin_command(func):
     return wrapper
 
 
+async def reply_packed(update: Update, text: str) -> None:
+    """Reply with a text which may not fit in a single message."""
+    for message in pack_text(text):
+        await update.message.reply_text(message)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     await help_command(update, context)
@@ -46,22 +58,30 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if update.effective_user.id in get_admins():
         await update.message.reply_text(
             "Available commands:\n"
-            "/subscribe <location> - Subscribe to alerts for a location\n"
+            f"/subscribe <location> - Subscribe to alerts for a location, type @{context.bot.username} <location> to search for one\n"
             "/unsubscribe <location> - Unsubscribe from a location\n"
+            "/regions - List regions, such as a whole city\n"
+            "/subscribe_region <region> - Subscribe to alerts for every location in a region\n"
+            "/unsubscribe_region <region> - Unsubscribe from a region\n"
             "/list - List your current subscriptions\n"
             "/get_users - Get all users\n"
             "/get_subscriptions - Get all subscriptions\n"
             "/test_alert - Test alert message, send a json file with the alert data\n"
             "/get_active_alerts - Prints out all active alerts\n"
+            "/stats <location> - Alert statistics of a location\n"
             "/help - Show this help message\n"
         )
     else:
         await update.message.reply_text(
             "Available commands:\n"
-            "/subscribe <location> - Subscribe to alerts for a location\n"
+            f"/subscribe <location> - Subscribe to alerts for a location, type @{context.bot.username} <location> to search for one\n"
             "/unsubscribe <location> - Unsubscribe from a location\n"
+            "/regions - List regions, such as a whole city\n"
+            "/subscribe_region <region> - Subscribe to alerts for every location in a region\n"
+            "/unsubscribe_region <region> - Unsubscribe from a region\n"
             "/list - List your current subscriptions\n"
             "/get_active_alerts - Prints out all active alerts\n"
+            "/stats <location> - Alert statistics of a location\n"
             "/help - Show this help message\n"
         )
 
@@ -74,9 +94,22 @@ async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     user_id = update.effective_user.id
     location = " ".join(context.args).lower()
+    location_id = gazetteer.resolve(location)
+
+    if location_id is not None:
+        location = gazetteer.get_name(location_id)
+    elif location != ALL_KEYWORD and not gazetteer.is_part_of_known(location):
+        suggestions = gazetteer.suggest(location)
+        if suggestions:
+            await update.message.reply_text(
+                f"Unknown location: {location}\nDid you mean:\n"
+                + "\n".join(f"/subscribe {suggestion}" for suggestion in suggestions)
+            )
+            return
 
-    if add_subscription(user_id, location):
+    if await add_subscription(user_id, location, location_id):
         logger.info(f"User {user_id} subscribed to alerts for: {location}")
+        subscription_matcher.sync()
         await update.message.reply_text(f"Subscribed to alerts for: {location}")
     else:
         await update.message.reply_text("Failed to add subscription. Please try again.")
@@ -92,9 +125,13 @@ async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     user_id = update.effective_user.id
     location = " ".join(context.args).lower()
+    location_id = gazetteer.resolve(location)
+    if location_id is not None and location not in get_user_subscriptions(user_id):
+        location = gazetteer.get_name(location_id)
 
-    if remove_subscription(user_id, location):
+    if await remove_subscription(user_id, location):
         logger.info(f"User {user_id} unsubscribed from alerts for: {location}")
+        subscription_matcher.sync()
         await update.message.reply_text(f"Unsubscribed from alerts for: {location}")
     else:
         await update.message.reply_text(
@@ -102,6 +139,77 @@ async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
 
 
+async def suggest_locations(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Suggest locations to subscribe to while typing an inline query."""
+    query = update.inline_query.query
+    if not query:
+        return
+    results = [
+        InlineQueryResultArticle(
+            id=str(gazetteer.get_id(location)),
+            title=location,
+            input_message_content=InputTextMessageContent(f"/subscribe {location}"),
+        )
+        for location in gazetteer.suggest(query, limit=10)
+    ]
+    await update.inline_query.answer(results, cache_time=60)
+
+
+async def list_regions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List all regions which can be subscribed to."""
+    regions_text = "\n".join(
+        f"- {regions.get_name(key)} ({key})" for key in regions.keys()
+    )
+    await reply_packed(update, f"Available regions:\n{regions_text}")
+
+
+async def subscribe_region(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Subscribe to alerts for every location in a region."""
+    if not context.args:
+        await update.message.reply_text("Please provide a region to subscribe to.")
+        return
+
+    user_id = update.effective_user.id
+    key = regions.resolve(" ".join(context.args).lower())
+    if key is None:
+        await update.message.reply_text(
+            "Unknown region, use /regions to see the available regions."
+        )
+        return
+
+    if await add_subscription(user_id, f"{REGION_PREFIX}{key}"):
+        logger.info(f"User {user_id} subscribed to alerts for region: {key}")
+        subscription_matcher.sync()
+        await update.message.reply_text(
+            f"Subscribed to alerts for region: {regions.get_name(key)}"
+        )
+    else:
+        await update.message.reply_text("Failed to add subscription. Please try again.")
+
+
+async def unsubscribe_region(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Unsubscribe from alerts for a region."""
+    if not context.args:
+        await update.message.reply_text("Please provide a region to unsubscribe from.")
+        return
+
+    user_id = update.effective_user.id
+    key = regions.resolve(" ".join(context.args).lower())
+
+    if key is not None and await remove_subscription(user_id, f"{REGION_PREFIX}{key}"):
+        logger.info(f"User {user_id} unsubscribed from alerts for region: {key}")
+        subscription_matcher.sync()
+        await update.message.reply_text(
+            f"Unsubscribed from alerts for region: {regions.get_name(key)}"
+        )
+    else:
+        await update.message.reply_text(
+            f"You were not subscribed to alerts for region: {' '.join(context.args)}"
+        )
+
+
 async def list_subscriptions(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -113,42 +221,87 @@ async def list_subscriptions(
         await update.message.reply_text("You have no active subscriptions.")
         return
 
-    locations_text = "\n".join(f"- {loc}" for loc in locations)
-    await update.message.reply_text(f"Your current subscriptions:\n{locations_text}")
+    locations_text = "\n".join(
+        (
+            f"- {regions.get_name(loc.removeprefix(REGION_PREFIX))} (region)"
+            if loc.startswith(REGION_PREFIX)
+            and regions.resolve(loc.removeprefix(REGION_PREFIX))
+            else f"- {loc}"
+        )
+        for loc in locations
+    )
+    await reply_packed(update, f"Your current subscriptions:\n{locations_text}")
 
 
 async def get_active_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Get all active alerts"""
-    alert_history = (await get_alert_history()).items()
-    active_alerts = []
-    for time, alerts in alert_history:
-        actual_time = datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S")
-        if datetime.datetime.now() - actual_time < timedelta(minutes=10):
-            active_alerts.extend(alerts)
+    active_alerts = await alert_store.get_active_alerts(ACTIVE_ALERTS_WINDOW)
 
     if not active_alerts or len(active_alerts) == 0:
         await update.message.reply_text("There are no active alerts at the moment.")
         return
 
-    alerts = defaultdict(list)
+    # Title to its locations, without repeating ones alerted under several IDs
+    alerts: dict[str, dict[str, None]] = defaultdict(dict)
     for alert in active_alerts:
-        alerts[alert.title] += alert.locations
-    for title, locations in alerts.items():
-        message_len = len(f"🚨 {title} 🚨\nמיקומים:\n" + "\n".join(locations))
-        TELEGRAM_MESSAGE_LIMIT = 1024
-        if message_len > TELEGRAM_MESSAGE_LIMIT:
-            for i in range(1 + message_len // TELEGRAM_MESSAGE_LIMIT):
-                print("HERE")
-                await update.message.reply_text(
-                    f"🚨 {title} 🚨\nמיקומים:\n"
-                    + "\n".join(
-                        locations[
-                            TELEGRAM_MESSAGE_LIMIT
-                            * i : TELEGRAM_MESSAGE_LIMIT
-                            * (i + 1)
-                        ]
-                    )
-                )
+        alerts[alert.title].update(dict.fromkeys(alert.locations))
+    for message in pack_sections(
+        (f"🚨 {title} 🚨\nמיקומים:", locations) for title, locations in alerts.items()
+    ):
+        await update.message.reply_text(message)
+
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the alert statistics of a location."""
+    location = " ".join(context.args).lower()
+    location_id = gazetteer.resolve(location)
+    if location_id is None:
+        suggestions = gazetteer.suggest(location)
+        await update.message.reply_text(
+            f"Unknown location: {location}"
+            + (
+                "\nDid you mean:\n"
+                + "\n".join(f"/stats {suggestion}" for suggestion in suggestions)
+                if suggestions
+                else ""
+            )
+        )
+        return
+
+    await alert_stats.refresh()
+    location_stats = alert_stats.get(location_id)
+    if location_stats is None:
+        await update.message.reply_text(
+            f"No alerts were recorded for: {gazetteer.get_name(location_id)}"
+        )
+        return
+
+    worst_hours = ", ".join(
+        f"{hour:02}:00 ({count})" for hour, count in location_stats.worst_hours()
+    )
+    categories = "\n".join(
+        f"- {title}: {count}" for title, count in location_stats.categories
+    )
+    await update.message.reply_text(
+        f"Alerts in {location_stats.name}:\n"
+        f"Today: {location_stats.today}\n"
+        f"Last 7 days: {location_stats.week}\n"
+        f"Since {location_stats.since:%Y-%m-%d}: {location_stats.total}\n"
+        f"Last alert: {format_duration(time.time() - location_stats.last_alert_at)} ago\n"
+        f"Worst hours: {worst_hours}\n"
+        f"By type:\n{categories}"
+    )
 
 
 @admin_command
@@ -156,7 +309,7 @@ async def get_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Get all users"""
     logger.info(f"User: {update.effective_user.id} requested all users")
     users = get_all_users()
-    await update.message.reply_text(f"All users:\n{users}")
+    await reply_packed(update, f"All users:\n{users}")
 
 
 @admin_command
@@ -167,7 +320,7 @@ async def get_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYPE)
         f"{user_id}: {locations}"
         for user_id, locations in get_all_subscriptions().items()
     )
-    await update.message.reply_text(f"All subscriptions:\n{subscriptions}")
+    await reply_packed(update, f"All subscriptions:\n{subscriptions}")
 
 
 @admin_command
@@ -180,18 +333,10 @@ async def send_message_to_all(
         return
 
     message = " ".join(context.args)
-    users = get_all_users()
-    success_count = 0
-    failure_count = 0
-
-    for user_id in users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send message to {user_id}: {e}")
-            failure_count += 1
+    stats = await dispatcher.submit_batch(
+        context.bot, [(pack_text(message), list(get_all_users()))]
+    )
 
     await update.message.reply_text(
-        f"Message sent to {success_count} users, failed to send to {failure_count} users."
+        f"Message sent to {stats.sent} users, failed to send to {stats.failed} users."
     )
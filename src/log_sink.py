@@ -0,0 +1,139 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, TextIO
+
+from config import (
+    DEBUG_FOLDER,
+    LOG_SINK_COMPRESS,
+    LOG_SINK_QUEUE_SIZE,
+    LOG_SINK_SEGMENT_BYTES,
+    LOG_SINK_SEGMENT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0
+
+
+class LogSink:
+    """
+    Writes debug records to rotating JSONL segments from a background task.
+    Records are queued without waiting, and dropped when the queue is full, so the alert path never waits on the disk.
+    """
+
+    def __init__(
+        self,
+        folder: str | None = DEBUG_FOLDER,
+        max_queue: int = LOG_SINK_QUEUE_SIZE,
+        segment_bytes: int = LOG_SINK_SEGMENT_BYTES,
+        segment_seconds: int = LOG_SINK_SEGMENT_SECONDS,
+        compress: bool = LOG_SINK_COMPRESS,
+    ) -> None:
+        self._folder = folder
+        self._max_queue = max_queue
+        self._segment_bytes = segment_bytes
+        self._segment_seconds = segment_seconds
+        self._compress = compress
+        self._queue: asyncio.Queue[dict[str, Any] | None] | None = None
+        self._task: asyncio.Task | None = None
+        self._segment: TextIO | None = None
+        self._segment_size = 0
+        self._segment_opened = 0.0
+        self._segment_count = 0
+        self.written = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._folder is None:
+            logger.warning("DEBUG_FOLDER is not set, debug records won't be saved")
+            return
+        os.makedirs(self._folder, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self._max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, kind: str, record: dict[str, Any]) -> None:
+        """Queue a record for writing, never blocking the caller."""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(
+                {"kind": kind, "time": datetime.now().isoformat(), **record}
+            )
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Debug log queue is full, dropped {self.dropped}")
+
+    async def close(self) -> None:
+        """Write everything still queued and close the current segment."""
+        if self._queue is None or self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._queue = None
+        await asyncio.to_thread(self._close_segment)
+        logger.info(
+            f"Debug log sink closed, written: {self.written}, dropped: {self.dropped}"
+        )
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(
+                        await asyncio.wait_for(
+                            self._queue.get(), deadline - time.monotonic()
+                        )
+                    )
+                except TimeoutError:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                closing = True
+            if not batch:
+                continue
+            lines = "".join(
+                json.dumps(record, ensure_ascii=False) + "\n" for record in batch
+            )
+            try:
+                await asyncio.to_thread(self._write, lines)
+                self.written += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error(f"Failed writing debug records: {type(e).__name__}: {e}")
+
+    def _write(self, lines: str) -> None:
+        if self._segment is not None and (
+            self._segment_size >= self._segment_bytes
+            or time.monotonic() - self._segment_opened >= self._segment_seconds
+        ):
+            self._close_segment()
+        if self._segment is None:
+            self._segment_count += 1
+            name = f"{self._folder}/alerts_{datetime.now().strftime('%y_%m_%d_%H_%M_%S')}_{self._segment_count}.jsonl"
+            if self._compress:
+                self._segment = gzip.open(f"{name}.gz", "at", encoding="utf-8")
+            else:
+                self._segment = open(name, "a", encoding="utf-8")
+            self._segment_size = 0
+            self._segment_opened = time.monotonic()
+        self._segment.write(lines)
+        self._segment.flush()
+        self._segment_size += len(lines.encode("utf-8"))
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+log_sink = LogSink()
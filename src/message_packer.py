@@ -0,0 +1,92 @@
+from typing import Iterable
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# A header, repeated on every message the section continues on, and its lines
+PackedSection = tuple[str, Iterable[str]]
+
+
+def message_length(text: str) -> int:
+    """Length of a message as Telegram limits it, in UTF-16 code units."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_line(line: str, limit: int) -> list[str]:
+    """Split a line which is too long to fit in a message by itself."""
+    if message_length(line) <= limit:
+        return [line]
+    chunks = []
+    start = size = 0
+    for index, char in enumerate(line):
+        char_size = 2 if ord(char) > 0xFFFF else 1
+        if size + char_size > limit:
+            chunks.append(line[start:index])
+            start, size = index, 0
+        size += char_size
+    chunks.append(line[start:])
+    return chunks
+
+
+def pack_sections(
+    sections: Iterable[PackedSection], limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> list[str]:
+    """
+    Greedily fill as few messages as possible with whole lines, keeping their order.
+    Sections are separated by a blank line, and a section which doesn't fit in one message
+    repeats its header at the top of the next one.
+    """
+    messages: list[str] = []
+    lines: list[str] = []
+    size = 0
+
+    def add(line: str, line_size: int) -> None:
+        nonlocal size
+        size += line_size + (1 if lines else 0)
+        lines.append(line)
+
+    def flush() -> None:
+        nonlocal size
+        if lines:
+            message = "\n".join(lines)
+            # Telegram refuses empty messages
+            if message.strip():
+                messages.append(message)
+            lines.clear()
+            size = 0
+
+    for header, body in sections:
+        header_size = message_length(header) if header else 0
+        if header_size > limit // 2:
+            # Too long to repeat, so it's only packed once like the rest of the lines
+            body = [*header.split("\n"), *body]
+            header, header_size = "", 0
+        # Room left for a line below the header
+        room = limit - header_size - 1 if header else limit
+        body_lines = [
+            (chunk, message_length(chunk))
+            for line in body
+            for chunk in _split_line(line, room)
+        ]
+        if lines:
+            # The blank line, the header and the first line have to fit for the section to start here
+            needed = size + 1 + (header_size + 1 if header else 0)
+            needed += body_lines[0][1] + 1 if body_lines else 0
+            if needed > limit:
+                flush()
+            else:
+                add("", 0)
+        if header:
+            add(header, header_size)
+        for line, line_size in body_lines:
+            if size + 1 + line_size > limit:
+                flush()
+                if header:
+                    add(header, header_size)
+            add(line, line_size)
+    flush()
+    return messages
+
+
+def pack_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Split a text into as few messages as possible, between lines where it can."""
+    return pack_sections([("", text.split("\n"))], limit)
@@ -0,0 +1,183 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DETECT_LATENCY_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 30, 60)
+
+_registry: list["Counter | Gauge | Histogram"] = []
+
+
+class Counter:
+    """
+    A monotonically increasing value
+    """
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.value = 0.0
+        _registry.append(self)
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Gauge(Counter):
+    """
+    A value which can go up and down
+    """
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, in seconds
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.description = description
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        _registry.append(self)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+fetch_seconds = Histogram("redalert_fetch_seconds", "Time spent downloading from OREF")
+parse_seconds = Histogram("redalert_parse_seconds", "Time spent parsing OREF responses")
+match_seconds = Histogram(
+    "redalert_match_seconds", "Time spent matching an alert to subscribers"
+)
+render_seconds = Histogram(
+    "redalert_render_seconds", "Time spent rendering the messages of an alert"
+)
+dispatch_seconds = Histogram(
+    "redalert_dispatch_seconds", "Time spent sending the messages of an alert"
+)
+detect_latency_seconds = Histogram(
+    "redalert_detect_latency_seconds",
+    "Time between an alert being raised and the bot picking it up",
+    DETECT_LATENCY_BUCKETS,
+)
+polls = Counter("redalert_polls_total", "Polls of the OREF alerts feed")
+empty_responses = Counter("redalert_empty_responses_total", "Empty OREF responses")
+not_modified_responses = Counter(
+    "redalert_not_modified_responses_total", "OREF responses which were not modified"
+)
+hedged_requests = Counter(
+    "redalert_hedged_requests_total", "OREF requests repeated to another endpoint"
+)
+unchanged_bodies = Counter(
+    "redalert_unchanged_bodies_total",
+    "OREF responses skipped since their body was the same as the last one",
+)
+parse_errors = Counter("redalert_parse_errors_total", "OREF responses failing to parse")
+dedup_hits = Counter(
+    "redalert_dedup_hits_total", "Alerts skipped since they were already handled"
+)
+dedup_evictions = Counter(
+    "redalert_dedup_evictions_total", "Alert IDs evicted from the dedup state"
+)
+messages_sent = Counter("redalert_messages_sent_total", "Telegram messages sent")
+send_failures = Counter(
+    "redalert_send_failures_total", "Telegram messages which failed to send"
+)
+coalesced_sends_saved = Counter(
+    "redalert_coalesced_sends_saved_total",
+    "Telegram messages saved by merging alerts into one message per user",
+)
+alert_events_stored = Counter(
+    "redalert_alert_events_stored_total",
+    "Alert locations stored in the alert event store",
+)
+command_seconds = Histogram(
+    "redalert_command_seconds", "Time spent handling a bot update received by webhook"
+)
+webhook_rejected = Counter(
+    "redalert_webhook_rejected_total",
+    "Webhook updates refused since the queue was full",
+)
+poll_interval_seconds = Gauge(
+    "redalert_poll_interval_seconds", "Current interval between polls"
+)
+startup_seconds = Gauge(
+    "redalert_startup_seconds", "Time between the bot starting up and its first poll"
+)
+
+
+def render_metrics() -> str:
+    """Render all metrics in the Prometheus text format."""
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics from the running event loop."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
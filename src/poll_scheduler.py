@@ -0,0 +1,103 @@
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from telegram.ext import CallbackContext, JobQueue
+
+from config import ACTIVE_CHECK_INTERVAL, ACTIVE_HOLD_SECONDS, ALERT_CHECK_INTERVAL
+from metrics import (
+    detect_latency_seconds,
+    poll_interval_seconds,
+    polls,
+    startup_seconds,
+)
+
+logger = logging.getLogger(__name__)
+
+DETECT_LATENCIES_KEPT = 100
+
+
+class AdaptivePollScheduler:
+    """
+    Schedules the next poll only after the previous one finished, so polls never overlap.
+    Polls every `active_interval` while an event is active, and backs off towards `idle_interval` once it's quiet.
+    Poll times follow a monotonic schedule rather than drifting by the duration of each poll.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[CallbackContext], Awaitable[bool]],
+        active_interval: float = ACTIVE_CHECK_INTERVAL,
+        idle_interval: float = ALERT_CHECK_INTERVAL,
+        active_hold: float = ACTIVE_HOLD_SECONDS,
+    ) -> None:
+        self._callback = callback
+        self._active_interval = active_interval
+        self._idle_interval = idle_interval
+        self._active_hold = active_hold
+        self._job_queue: JobQueue | None = None
+        self._next_run = 0.0
+        self._active_until = 0.0
+        self._started_at = 0.0
+        self.interval = idle_interval
+        self.polls = 0
+        self.overruns = 0
+        self.detect_latencies: deque[float] = deque(maxlen=DETECT_LATENCIES_KEPT)
+
+    def start(self, job_queue: JobQueue, started_at: float | None = None) -> None:
+        """Start polling, reporting the time from `started_at` to the first poll."""
+        self._job_queue = job_queue
+        self._next_run = time.monotonic()
+        self._started_at = self._next_run if started_at is None else started_at
+        self._schedule()
+
+    def mark_active(self) -> None:
+        """Keep polling fast for a while, e.g. after an alert was seen."""
+        self._active_until = time.monotonic() + self._active_hold
+
+    def record_detect_latency(self, latency: float) -> None:
+        """Record how long after an alert was raised it was picked up."""
+        self.detect_latencies.append(latency)
+        detect_latency_seconds.observe(latency)
+
+    def _schedule(self) -> None:
+        self._job_queue.run_once(
+            self._run, when=max(0.0, self._next_run - time.monotonic())
+        )
+
+    async def _run(self, context: CallbackContext) -> None:
+        self.polls += 1
+        polls.inc()
+        try:
+            if await self._callback(context):
+                self.mark_active()
+        except Exception as e:
+            logger.exception(f"Error polling for alerts: {type(e).__name__}: {e}")
+        finally:
+            now = time.monotonic()
+            if self.polls == 1:
+                startup_seconds.set(now - self._started_at)
+                logger.info(
+                    f"First poll done {now - self._started_at:.2f}s after startup"
+                )
+            if now < self._active_until:
+                self.interval = self._active_interval
+            else:
+                self.interval = min(self._idle_interval, self.interval * 2)
+            poll_interval_seconds.set(self.interval)
+            self._next_run += self.interval
+            if self._next_run < now:
+                # The poll took longer than the interval, start over from now instead of bursting to catch up
+                self.overruns += 1
+                self._next_run = now
+            self._schedule()
+
+    def __str__(self):
+        latencies = sorted(self.detect_latencies)
+        median = f"{latencies[len(latencies) // 2]:.2f}s" if latencies else "n/a"
+        worst = f"{latencies[-1]:.2f}s" if latencies else "n/a"
+        return (
+            f"AdaptivePollScheduler(interval={self.interval}s, polls={self.polls}, overruns={self.overruns}, "
+            f"detect_latency_p50={median}, detect_latency_max={worst})"
+        )
@@ -0,0 +1,76 @@
+import json
+import logging
+from pathlib import Path
+
+from gazetteer import gazetteer, normalize
+
+logger = logging.getLogger(__name__)
+
+REGIONS_FILE = Path(__file__).parent / "data" / "regions.json"
+REGION_PREFIX = "region:"
+
+
+class RegionIndex:
+    """
+    Named regions loaded from a versioned data file, each expanded to a bitset over gazetteer location IDs.
+    Regions are defined by location names and name prefixes, and are re-expanded whenever the gazetteer learns new locations.
+    """
+
+    def __init__(self) -> None:
+        self._definitions: dict[str, dict] = {}
+        self._masks: dict[str, int] = {}
+        self._gazetteer_version = -1
+        self.version = 0
+
+    def load(self, file: Path = REGIONS_FILE) -> None:
+        with open(file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._definitions = data["regions"]
+        self.version = data["version"]
+        self._gazetteer_version = -1
+        logger.info(f"Loaded {len(self._definitions)} regions, version {self.version}")
+
+    def _expand(self) -> None:
+        self._masks = {}
+        for key, definition in self._definitions.items():
+            locations = {normalize(name) for name in definition.get("locations", [])}
+            prefixes = [normalize(prefix) for prefix in definition.get("prefixes", [])]
+            mask = 0
+            for location_id, name in gazetteer.items():
+                normalized = normalize(name)
+                if normalized in locations or any(
+                    normalized.startswith(prefix) for prefix in prefixes
+                ):
+                    mask |= 1 << location_id
+            self._masks[key] = mask
+        self._gazetteer_version = gazetteer.version
+
+    @property
+    def expansion_version(self) -> tuple[int, int]:
+        """Changes whenever region masks may have changed."""
+        return self.version, gazetteer.version
+
+    def get_mask(self, key: str) -> int:
+        if self._gazetteer_version != gazetteer.version:
+            self._expand()
+        return self._masks.get(key, 0)
+
+    def resolve(self, text: str) -> str | None:
+        """Get the key of a region by its key or its name."""
+        text = text.removeprefix(REGION_PREFIX)
+        if text in self._definitions:
+            return text
+        normalized = normalize(text)
+        for key, definition in self._definitions.items():
+            if normalize(definition["name"]) == normalized:
+                return key
+        return None
+
+    def get_name(self, key: str) -> str:
+        return self._definitions[key]["name"]
+
+    def keys(self) -> list[str]:
+        return list(self._definitions)
+
+
+regions = RegionIndex()
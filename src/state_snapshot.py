@@ -0,0 +1,98 @@
+import json
+import logging
+import math
+import time
+import zlib
+
+from telegram.ext import CallbackContext
+
+from alert_monitor import alert_dedup, alerts_handled
+from database import load_state, save_state
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = "alert_dedup"
+SNAPSHOT_FORMAT = 1
+
+
+class StateSnapshot:
+    """
+    Periodically saves the alert dedup state to the database, so a restarted bot doesn't re-send the alerts
+    still in the feed. Each snapshot replaces the previous one in a single transaction, so a crash leaves
+    either one of them whole, and nothing is written while no alert was handled.
+    Cache expiry is saved as Unix times, which are rebased onto the monotonic clock when restored.
+    """
+
+    def __init__(self, name: str = SNAPSHOT_NAME) -> None:
+        self._name = name
+        self._saved_version: int | None = None
+        self.saves = 0
+        self.size = 0
+
+    def _encode(self) -> bytes:
+        state = {
+            "format": SNAPSHOT_FORMAT,
+            "handled": {
+                title: [
+                    [location, math.ceil(expires_at)]
+                    for location, expires_at in cache.dump()
+                ]
+                for title, cache in alerts_handled.items()
+            },
+            "dedup": alert_dedup.dump(),
+        }
+        return zlib.compress(
+            json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode()
+        )
+
+    async def save(self) -> None:
+        """Save the dedup state, unless it didn't change since the last save."""
+        version = alert_dedup.version
+        if version == self._saved_version:
+            return
+        data = self._encode()
+        await save_state(self._name, time.time(), data)
+        self._saved_version = version
+        self.saves += 1
+        self.size = len(data)
+
+    async def save_job(self, context: CallbackContext) -> None:
+        try:
+            await self.save()
+        except Exception as e:
+            logger.error(f"Error saving the dedup state: {type(e).__name__}: {e}")
+
+    def restore(self) -> None:
+        """Restore the last saved dedup state, dropping cache entries which expired meanwhile."""
+        try:
+            saved = load_state(self._name)
+            if saved is None:
+                return
+            saved_at, data = saved
+            state = json.loads(zlib.decompress(data))
+            if state.get("format") != SNAPSHOT_FORMAT:
+                logger.warning(
+                    f"Ignoring a dedup state snapshot of format {state.get('format')}"
+                )
+                return
+            for title, entries in state["handled"].items():
+                alerts_handled[title].restore(entries)
+                if len(alerts_handled[title]) == 0:
+                    del alerts_handled[title]
+            alert_dedup.restore(state["dedup"])
+        except Exception as e:
+            logger.exception(
+                f"Error restoring the dedup state: {type(e).__name__}: {e}"
+            )
+            return
+        self._saved_version = alert_dedup.version
+        logger.info(
+            f"Restored the dedup state saved {time.time() - saved_at:.1f}s ago: {len(alert_dedup)} alert IDs, "
+            f"{sum(map(len, alerts_handled.values()))} handled locations of {len(alerts_handled)} titles"
+        )
+
+    def __str__(self):
+        return f"StateSnapshot(saves={self.saves}, size={self.size}B)"
+
+
+state_snapshot = StateSnapshot()
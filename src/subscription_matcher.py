@@ -0,0 +1,224 @@
+import logging
+from collections import defaultdict, deque
+
+from database import (
+    get_all_subscriptions,
+    get_subscription_changes,
+    get_subscription_location_ids,
+    get_subscriptions_version,
+)
+from gazetteer import gazetteer
+from regions import REGION_PREFIX, regions
+
+logger = logging.getLogger(__name__)
+
+ALL_KEYWORD = "all"
+
+
+class SubscriptionMatcher:
+    """
+    Matches alert locations against every subscription at once.
+    Subscriptions made to a known location are matched by the gazetteer ID stored with them, and region subscriptions by intersecting
+    each subscriber's bitset of region locations with the alert's bitset. Any other subscribed string is matched
+    as a substring, using an Aho-Corasick automaton over all of them, with an inverted index from each string
+    to the users subscribed to it, so an alert is matched in one pass over its locations.
+    """
+
+    def __init__(self) -> None:
+        self._id_subscribers: dict[int, set[int]] = {}
+        self._user_regions: dict[int, set[str]] = {}
+        self._region_masks: dict[int, int] = {}
+        self._regions_version: tuple[int, int] | None = None
+        self._subscribers: dict[str, set[int]] = {}
+        self._all_users: set[int] = set()
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[str]] = [[]]
+        self._dirty = False
+        self.version = -1
+
+    def sync(self) -> None:
+        """Bring the matcher up to date with the subscriptions snapshot, incrementally when possible."""
+        version = get_subscriptions_version()
+        if version != self.version:
+            changes = get_subscription_changes(self.version)
+            if changes is None:
+                self.load(
+                    get_all_subscriptions(), get_subscription_location_ids(), version
+                )
+                return
+            for operation, user_id, location, location_id in changes:
+                if operation == "add":
+                    self.add(user_id, location, location_id)
+                else:
+                    self.remove(user_id, location, location_id)
+            self.version = version
+        self._refresh()
+
+    def load(
+        self,
+        subscriptions: dict[int, frozenset[str]],
+        location_ids: dict[tuple[int, str], int] | None = None,
+        version: int = -1,
+    ) -> None:
+        """Replace the matcher contents with a full subscriptions mapping, and the location IDs of exact ones."""
+        location_ids = location_ids or {}
+        self._id_subscribers = {}
+        self._user_regions = {}
+        self._regions_version = None
+        self._subscribers = {}
+        self._all_users = set()
+        for user_id, locations in subscriptions.items():
+            for location in locations:
+                self.add(user_id, location, location_ids.get((user_id, location)))
+        self._refresh()
+        self.version = version
+        logger.info(
+            f"Subscription matcher loaded with {len(self._id_subscribers)} locations and "
+            f"{len(self._subscribers)} patterns for {len(subscriptions)} users"
+        )
+
+    def add(self, user_id: int, pattern: str, location_id: int | None = None) -> None:
+        if pattern == ALL_KEYWORD:
+            self._all_users.add(user_id)
+            return
+        if not pattern:
+            return
+        if pattern.startswith(REGION_PREFIX):
+            self._user_regions.setdefault(user_id, set()).add(
+                pattern.removeprefix(REGION_PREFIX)
+            )
+            self._regions_version = None
+            return
+        if location_id is not None:
+            self._id_subscribers.setdefault(location_id, set()).add(user_id)
+            return
+        if pattern not in self._subscribers:
+            # Only a new pattern changes the automaton, new subscribers only touch the index
+            self._subscribers[pattern] = set()
+            self._dirty = True
+        self._subscribers[pattern].add(user_id)
+
+    def remove(
+        self, user_id: int, pattern: str, location_id: int | None = None
+    ) -> None:
+        if pattern == ALL_KEYWORD:
+            self._all_users.discard(user_id)
+            return
+        if pattern.startswith(REGION_PREFIX):
+            user_regions = self._user_regions.get(user_id, set())
+            user_regions.discard(pattern.removeprefix(REGION_PREFIX))
+            if not user_regions:
+                self._user_regions.pop(user_id, None)
+            self._regions_version = None
+            return
+        if location_id is not None:
+            subscribers = self._id_subscribers.get(location_id, set())
+            subscribers.discard(user_id)
+            if not subscribers:
+                self._id_subscribers.pop(location_id, None)
+            return
+        subscribers = self._subscribers.get(pattern)
+        if subscribers is None:
+            return
+        subscribers.discard(user_id)
+        if not subscribers:
+            del self._subscribers[pattern]
+            self._dirty = True
+
+    def _refresh(self) -> None:
+        """Rebuild what changes made stale, so matching never has to."""
+        if self._dirty:
+            self._build()
+        if self._regions_version != regions.expansion_version:
+            self._build_region_masks()
+
+    def _build(self) -> None:
+        goto: list[dict[str, int]] = [{}]
+        output: list[list[str]] = [[]]
+        for pattern in self._subscribers:
+            state = 0
+            for char in pattern:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(pattern)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                if fail[next_state] == next_state:
+                    fail[next_state] = 0
+                output[next_state] = output[next_state] + output[fail[next_state]]
+
+        self._goto, self._fail, self._output = goto, fail, output
+        self._dirty = False
+
+    def _build_region_masks(self) -> None:
+        self._region_masks = {}
+        for user_id, user_regions in self._user_regions.items():
+            mask = 0
+            for key in user_regions:
+                mask |= regions.get_mask(key)
+            if mask:
+                self._region_masks[user_id] = mask
+        self._regions_version = regions.expansion_version
+
+    def _find_patterns(self, text: str) -> set[str]:
+        goto, fail, output = self._goto, self._fail, self._output
+        found: set[str] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def match(self, locations: list[str]) -> dict[int, list[str]]:
+        """
+        Returns a mapping of user ID to the alert locations matching any of their subscriptions.
+        Only reads the automaton and region masks as of the last sync().
+        """
+        matches: dict[int, list[str]] = defaultdict(list)
+        alert_mask = 0
+        location_ids: list[int | None] = []
+        for location in locations:
+            users = set(self._all_users)
+            location_id = gazetteer.get_id(location)
+            location_ids.append(location_id)
+            if location_id is not None:
+                alert_mask |= 1 << location_id
+                users.update(self._id_subscribers.get(location_id, ()))
+            for pattern in self._find_patterns(location):
+                users.update(self._subscribers[pattern])
+            for user_id in users:
+                matches[user_id].append(location)
+
+        for user_id, mask in self._region_masks.items():
+            hits = mask & alert_mask
+            if not hits:
+                continue
+            matched = set(matches.get(user_id, ()))
+            matches[user_id] = [
+                location
+                for location, location_id in zip(locations, location_ids)
+                if location in matched
+                or (location_id is not None and hits >> location_id & 1)
+            ]
+        return matches
+
+
+subscription_matcher = SubscriptionMatcher()
@@ -1,44 +1,112 @@
 import logging
 import time
+from collections import deque
+from typing import Iterable
 
-from config import CACHE_TIMEOUT
+from config import CACHE_MAX_ENTRIES, CACHE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
 
 class TemporalCache[T]:
     """
-    A cache which allows to set an expiry duration for entries in it
+    A cache which allows to set an expiry duration for entries in it.
+    All entries share the same timeout, so expiry order is insertion order: a queue of (expiry, values) batches in
+    insertion order is also sorted by expiry, and expiring is popping from its front, in amortized O(1) per entry.
+    Entries are only removed by expire() and the entry cap, lookups just compare the expiry.
     """
 
-    def __init__(self, timeout: float = CACHE_TIMEOUT) -> None:
+    def __init__(
+        self, timeout: float = CACHE_TIMEOUT, max_entries: int = CACHE_MAX_ENTRIES
+    ) -> None:
         self._timeout = timeout
+        self._max_entries = max_entries
         self._cache = dict[T, float]()
+        self._expiry_queue = deque[tuple[float, list[T]]]()
 
     def _get_timeout(self) -> float:
-        return time.time() + self._timeout
+        return time.monotonic() + self._timeout
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _evict(self) -> None:
+        """Drop the entries added first until the cache is within its size."""
+        cache, queue = self._cache, self._expiry_queue
+        while len(cache) > self._max_entries:
+            expiry_time, values = queue.popleft()
+            for index, value in enumerate(values):
+                # Re-added values leave stale entries behind in the queue
+                if cache.get(value) == expiry_time:
+                    del cache[value]
+                    if len(cache) <= self._max_entries:
+                        queue.appendleft((expiry_time, values[index + 1 :]))
+                        return
 
     def add(self, value: T) -> None:
-        self._cache[value] = self._get_timeout()
+        expiry_time = self._get_timeout()
+        self._cache[value] = expiry_time
+        self._expiry_queue.append((expiry_time, [value]))
+        self._evict()
+
+    def add_all(self, data: Iterable[T]) -> None:
+        expiry_time = self._get_timeout()
+        values = list(data)
+        self._cache.update(dict.fromkeys(values, expiry_time))
+        self._expiry_queue.append((expiry_time, values))
+        self._evict()
+
+    def expire(self, now: float | None = None) -> int:
+        """Remove all expired entries, returning how many were removed."""
+        if now is None:
+            now = time.monotonic()
+        cache, queue = self._cache, self._expiry_queue
+        if not queue or queue[0][0] > now:
+            return 0
+        if queue[-1][0] <= now:
+            # Every entry is due, as the newest expiry of each value is queued
+            expired = len(cache)
+            cache.clear()
+            queue.clear()
+            return expired
+        expired = 0
+        while queue[0][0] <= now:
+            expiry_time, values = queue.popleft()
+            for value in values:
+                if cache.get(value) == expiry_time:
+                    del cache[value]
+                    expired += 1
+        return expired
 
     def __contains__(self, key: T) -> bool:
-        expiry_time = self._cache.get(key, None)
-        if expiry_time is None:
-            return False
-        if time.time() >= expiry_time:
-            self._cache.pop(key, None)
-            return False
-        return True
+        expiry_time = self._cache.get(key)
+        return expiry_time is not None and time.monotonic() < expiry_time
 
-    def get_all(self) -> list[T]:
-        now = time.time()
-        timed_out_values = [
-            value for value, expiry_time in self._cache.items() if now >= expiry_time
+    def dump(self) -> list[tuple[T, float]]:
+        """Get the entries which haven't expired, with their expiry as a Unix time so another process can restore them."""
+        now = time.monotonic()
+        self.expire(now)
+        offset = time.time() - now
+        return [
+            (value, expiry_time + offset) for value, expiry_time in self._cache.items()
         ]
-        for value in timed_out_values:
-            self._cache.pop(value)
-        return list(self._cache.keys())
 
-    def add_all(self, data: list[T]) -> None:
-        for entry in data:
-            self.add(entry)
+    def restore(self, entries: Iterable[tuple[T, float]]) -> None:
+        """Add dumped entries which haven't expired yet, rebasing their expiry onto this process' monotonic clock."""
+        offset = time.monotonic() - time.time()
+        for value, expires_at in entries:
+            expiry_time = expires_at + offset
+            if expiry_time > self._cache.get(value, float("-inf")):
+                self._cache[value] = expiry_time
+        self._expiry_queue = deque(
+            sorted(
+                ((expiry_time, [value]) for value, expiry_time in self._cache.items()),
+                key=lambda entry: entry[0],
+            )
+        )
+        self.expire()
+        self._evict()
+
+    def get_all(self) -> list[T]:
+        self.expire()
+        return list(self._cache.keys())
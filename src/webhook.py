@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import (
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+from metrics import command_seconds, webhook_rejected
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Receives the updates Telegram pushes to the bot, instead of long polling for them.
+    Updates go through a bounded queue handled by a few workers, so a flood of commands can't take over the
+    event loop the alert job runs on. Once the queue is full updates are refused, and Telegram retries them later.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret: str | None = WEBHOOK_SECRET,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_WORKERS,
+    ) -> None:
+        self._application = application
+        self._host = host
+        self._port = port
+        self._path = path
+        self._secret = secret
+        self._queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=queue_size)
+        self._workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._runner: web.AppRunner | None = None
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+        app = web.Application()
+        app.router.add_post(self._path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        logger.info(
+            f"Receiving updates on http://{self._host}:{self._port}{self._path}"
+        )
+
+    async def close(self) -> None:
+        """Stop receiving updates, and finish handling the queued ones."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self._secret and request.headers.get(SECRET_HEADER) != self._secret:
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self._application.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Received a malformed update: {type(e).__name__}: {e}")
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            webhook_rejected.inc()
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _work(self) -> None:
+        while True:
+            update = await self._queue.get()
+            try:
+                with command_seconds.time():
+                    await self._application.process_update(update)
+            except Exception as e:
+                logger.exception(f"Error handling update: {type(e).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def __str__(self):
+        return (
+            f"WebhookServer(received={self.received}, rejected={self.rejected}, "
+            f"queued={self._queue.qsize()})"
+        )
+
+
+async def run_webhook(application: Application) -> None:
+    """Run the application until a shutdown signal, with updates pushed to WEBHOOK_URL."""
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+
+    server = WebhookServer(application)
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop.wait()
+        logger.info("Received shutdown signal. Cleaning up...")
+        await server.close()
+        logger.info(f"Webhook: {server}")
+        await application.stop()
+        # Like run_polling, before the bot is shut down so pending alerts can still be sent
+        if application.post_stop:
+            await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
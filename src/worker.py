@@ -0,0 +1,62 @@
+"""
+Sends alerts to a shard of the users, as published by a bot started with CLUSTER_ROLE=leader.
+Run one per shard, with CLUSTER_SHARD set to 0 .. CLUSTER_SHARDS - 1.
+"""
+
+import asyncio
+import logging
+import signal
+
+from telegram import Bot
+
+from alert_coalescer import alert_coalescer
+from cluster import ClusterWorker
+from config import (
+    CLUSTER_SHARD,
+    CLUSTER_SHARDS,
+    SHUTDOWN_DRAIN_TIMEOUT,
+    WORKER_BOT_TOKEN,
+)
+from database import close_db, load_snapshot
+from dispatcher import dispatcher
+from gazetteer import gazetteer
+from regions import regions
+from subscription_matcher import subscription_matcher
+
+logger = logging.getLogger(__name__)
+
+
+def setup():
+    load_snapshot()
+    gazetteer.load()
+    regions.load()
+
+
+async def run() -> None:
+    task = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, task.cancel)
+
+    worker = ClusterWorker(CLUSTER_SHARD)
+    logger.info(f"Starting worker of shard {CLUSTER_SHARD}/{CLUSTER_SHARDS}")
+    async with Bot(WORKER_BOT_TOKEN) as bot:
+        subscription_matcher.sync()
+        try:
+            await worker.run(bot)
+        except asyncio.CancelledError:
+            logger.info("Received shutdown signal. Cleaning up...")
+        finally:
+            await worker.drain()
+            await alert_coalescer.close(bot)
+            await dispatcher.drain(SHUTDOWN_DRAIN_TIMEOUT)
+            logger.info(f"Cluster: {worker}")
+
+
+def main():
+    setup()
+    asyncio.run(run())
+    close_db()
+
+
+if __name__ == "__main__":
+    main()
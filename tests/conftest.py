@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("SUPERUSER_ID", "1")
+os.environ.setdefault("ALERT_CHECK_INTERVAL", "1")
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -0,0 +1,13 @@
+from gazetteer import normalize
+
+
+def test_normalize_ignores_niqqud():
+    assert normalize("תֵּל אָבִיב") == "תל אביב"
+
+
+def test_normalize_treats_maqaf_as_separator():
+    assert normalize("תל־אביב") == normalize("תל-אביב") == normalize("תל אביב")
+
+
+def test_normalize_ignores_quotes_and_case():
+    assert normalize('Kiryat "Shmona"') == normalize("kiryat shmona")
@@ -0,0 +1,22 @@
+from message_packer import message_length, pack_sections, pack_text
+
+
+def test_pack_text_of_empty_text_has_no_messages():
+    assert pack_text("") == []
+    assert pack_text("\n \n") == []
+
+
+def test_pack_text_fits_in_one_message():
+    assert pack_text("a\nb") == ["a\nb"]
+
+
+def test_pack_text_splits_between_lines():
+    messages = pack_text("\n".join(["x" * 10] * 10), limit=32)
+    assert all(message_length(message) <= 32 for message in messages)
+    assert "\n".join(messages).split("\n") == ["x" * 10] * 10
+
+
+def test_pack_sections_repeats_the_header():
+    messages = pack_sections([("title", ["x" * 10] * 4)], limit=30)
+    assert len(messages) > 1
+    assert all(message.startswith("title\n") for message in messages)